@@ -0,0 +1,221 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from mock_neshan import MockNeshanServer
+from planner import RoutePlanner, build_route_table, plan_route
+from route_map import build_route_map
+
+TEHRAN_BOUNDS = ((35.60, 51.20), (35.80, 51.55))
+TEHRAN_DEPOT = (35.6997, 51.3380)
+DEFAULT_SIZES = (10, 25, 50, 100, 250, 500, 1000)
+PHASES = ('matrix', 'decompose', 'solve', 'schedule', 'prefetch', 'map', 'map_render', 'table')
+
+
+def synthetic_instance(size, seed=0):
+    """نقاط تصادفی در محدوده تهران با تراکم محله‌ای؛ نقطه اول انبار است
+
+    برای هر اندازه و seed همیشه همان نقاط تولید می‌شوند.
+    """
+    rng = np.random.default_rng([seed, size])
+    low, high = np.array(TEHRAN_BOUNDS[0]), np.array(TEHRAN_BOUNDS[1])
+    centers = rng.uniform(low, high, size=(max(1, size // 25), 2))
+    points = centers[rng.integers(len(centers), size=size)] + rng.normal(0, 0.012, size=(size, 2))
+    points = np.clip(points, low, high).round(6)
+    locations = [TEHRAN_DEPOT] + [(float(lat), float(lng)) for lat, lng in points]
+    location_names = ["انبار"] + [f"نمایندگی {i}" for i in range(1, size + 1)]
+    return locations, location_names
+
+
+def _improvements(series):
+    """فقط نقاطی از روند هزینه که بهترین هزینه را بهبود داده‌اند"""
+    best = float('inf')
+    points = []
+    for at, cost in series:
+        if cost < best:
+            best = cost
+            points.append([at, cost])
+    return points
+
+
+def run_case(size, server, options):
+    """اجرای کامل یک نمونه و برگرداندن زمان مراحل، تعداد درخواست‌ها و کیفیت مسیر"""
+    locations, location_names = synthetic_instance(size, options['seed'])
+    planner = RoutePlanner(
+        'benchmark',
+        requests_per_second=options['requests_per_second'],
+        max_workers=options['max_workers'],
+        matrix_backend=options['matrix_backend'],
+        direction_url=server.direction_url,
+        distance_matrix_url=server.distance_matrix_url
+    )
+    metrics = planner.metrics
+
+    started = time.perf_counter()
+    results = plan_route(
+        planner, locations, location_names, options['station_time'], "08:00",
+        sparse_k=options['sparse_k'],
+        portfolio=options['portfolio'],
+        decompose=options['decompose'],
+        cluster_size=options['cluster_size']
+    )
+    case = {'size': size}
+    if results is None:
+        case['error'] = "مسیر بهینه محاسبه نشد"
+        return case
+
+    with metrics.phase('prefetch'):
+        planner.prefetch_route_legs(locations, results['route_points'])
+    with metrics.phase('map'):
+        route_map, _ = build_route_map(
+            planner, locations, results['route_points'], location_names, results['time_matrix'],
+            results['station_time'], results['start_time_str'], schedule=results['schedule'])
+    with metrics.phase('map_render'):
+        route_map.get_root().render()
+    with metrics.phase('table'):
+        build_route_table(results)
+    elapsed = time.perf_counter() - started
+
+    snapshot = metrics.snapshot()
+    phases = {h['labels']['phase']: round(h['sum'], 4)
+              for h in snapshot['histograms'] if h['name'] == 'nova_phase_seconds'}
+    case.update({
+        'seconds': round(elapsed, 4),
+        'phases': {phase: phases[phase] for phase in PHASES if phase in phases},
+        'api_requests': metrics.total('nova_api_requests_total'),
+        'api_errors': metrics.total('nova_api_requests_total') - metrics.total('nova_api_requests_total',
+                                                                                 status=200),
+        'retries': metrics.total('nova_api_retries_total'),
+        'estimated_cells': metrics.total('nova_matrix_cells_total', source='estimate'),
+        'total_time': results['total_time'],
+        'total_distance': results['total_distance'],
+        'solver_solutions': metrics.total('nova_solver_solutions_total'),
+        'objective_trace': _improvements(snapshot['series'].get('nova_solver_objective', []))
+    })
+    return case
+
+
+def environment():
+    """مشخصات محیط اجرا برای مقایسه منصفانه نتایج"""
+    import ortools
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'ortools': ortools.__version__,
+        'commit': commit
+    }
+
+
+def compare(current, baseline, tolerance, quality_tolerance, min_delta=0.5):
+    """مقایسه با خط مبنا؛ خروجی فهرست پسرفت‌ها (زمان مراحل یا کیفیت مسیر)"""
+    previous = {case['size']: case for case in baseline['results'] if 'error' not in case}
+    regressions = []
+    for case in current['results']:
+        old = previous.get(case['size'])
+        if old is None or 'error' in case:
+            continue
+        for phase, seconds in case['phases'].items():
+            before = old['phases'].get(phase)
+            # اختلاف‌های کمتر از min_delta ثانیه نوفه زمان‌سنجی‌اند و پسرفت شمرده نمی‌شوند
+            if before is not None and seconds > before * (1 + tolerance) and seconds - before > min_delta:
+                regressions.append(f"{case['size']} نقطه، مرحله {phase}: {before:.3f}s → {seconds:.3f}s")
+        if case['total_time'] > old['total_time'] * (1 + quality_tolerance):
+            regressions.append(
+                f"{case['size']} نقطه، کیفیت مسیر: {old['total_time']}s → {case['total_time']}s")
+        if case['api_requests'] > old['api_requests']:
+            regressions.append(
+                f"{case['size']} نقطه، درخواست API: {old['api_requests']} → {case['api_requests']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="سنجش کارایی Nova روی نمونه‌های مصنوعی تهران با سرور محلی شبیه نشان")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="تعداد نمایندگی‌ها")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help="میانگین تأخیر پاسخ سرور شبیه (ثانیه)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="احتمال پاسخ خطای 429/503")
+    parser.add_argument('--station-time', type=int, default=15, help="زمان توقف در هر ایستگاه (دقیقه)")
+    parser.add_argument('--requests-per-second', type=float, default=1000.0)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--matrix-backend', choices=['matrix', 'direction'], default='matrix')
+    parser.add_argument('--sparse-k', type=int, default=None)
+    parser.add_argument('--portfolio', action='store_true')
+    parser.add_argument('--decompose', action='store_true')
+    parser.add_argument('--cluster-size', type=int, default=150)
+    parser.add_argument('-o', '--output', default=os.path.join('benchmarks', 'latest.json'),
+                        help="فایل JSON نتایج")
+    parser.add_argument('--baseline', default=None, help="فایل نتایج قبلی برای مقایسه")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="پسرفت مجاز زمان هر مرحله (نسبی)")
+    parser.add_argument('--quality-tolerance', type=float, default=0.02, help="پسرفت مجاز مدت کل مسیر (نسبی)")
+    parser.add_argument('--min-delta', type=float, default=0.5, help="پسرفت مجاز زمان هر مرحله (ثانیه)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    options = {
+        'seed': args.seed,
+        'station_time': args.station_time * 60,
+        'requests_per_second': args.requests_per_second,
+        'max_workers': args.max_workers,
+        'matrix_backend': args.matrix_backend,
+        'sparse_k': args.sparse_k,
+        'portfolio': args.portfolio,
+        'decompose': args.decompose,
+        'cluster_size': args.cluster_size
+    }
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'config': dict(options, latency=args.latency, error_rate=args.error_rate),
+        'results': []
+    }
+    with MockNeshanServer(latency=args.latency, error_rate=args.error_rate, seed=args.seed) as server:
+        for size in args.sizes:
+            case = run_case(size, server, options)
+            report['results'].append(case)
+            if 'error' in case:
+                print(f"{size:>5} نقطه: {case['error']}")
+                continue
+            phases = "  ".join(f"{phase}={seconds:.2f}s" for phase, seconds in case['phases'].items())
+            print(f"{size:>5} نقطه: {case['seconds']:.2f}s  {phases}  "
+                  f"API={case['api_requests']}  مدت مسیر={case['total_time']}s")
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print("هشدار: تنظیمات این اجرا با خط مبنا یکسان نیست و مقایسه معتبر نیست")
+        regressions = compare(report, baseline, args.tolerance, args.quality_tolerance, args.min_delta)
+        for regression in regressions:
+            print(f"پسرفت: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+# ماژول‌های برنامه در ریشه مخزن هستند؛ این فایل ریشه را برای آزمون‌ها به sys.path می‌افزاید
+import numpy as np
+import pytest
+
+from mock_neshan import MockNeshanServer
+
+
+def random_matrices(size, seed=0):
+    """ماتریس‌های فاصله و زمان int32 بین نقاط تصادفی (زمان: فاصله تقسیم بر ۸)"""
+    points = np.random.default_rng(seed).uniform(0, 10_000, size=(size, 2))
+    distance = np.hypot(*(points[:, None] - points[None]).transpose(2, 0, 1)).astype(np.int32)
+    return distance, distance // 8
+
+
+@pytest.fixture
+def matrices():
+    return random_matrices
+
+
+@pytest.fixture
+def server():
+    with MockNeshanServer() as server:
+        yield server
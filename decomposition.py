@@ -0,0 +1,148 @@
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from geo import haversine_matrix, kmeans
+from solver import adaptive_time_limit, build_transit_matrix, solve_path, solve_transit
+
+
+def cluster_stops(locations, cluster_size, seed=0):
+    """تقسیم نقاط (به جز انبار) به خوشه‌های جغرافیایی با حداکثر اندازه cluster_size"""
+    points = np.asarray(locations, dtype=float)
+    pending = [np.arange(1, len(locations))]
+    clusters = []
+    while pending:
+        indices = pending.pop()
+        if len(indices) <= cluster_size:
+            if len(indices):
+                clusters.append(indices)
+            continue
+        k = int(np.ceil(len(indices) / cluster_size))
+        labels = kmeans(points[indices], k, seed=seed)
+        groups = [indices[labels == c] for c in np.unique(labels)]
+        if len(groups) == 1:
+            groups = np.array_split(indices, k)
+        pending.extend(groups)
+    return clusters
+
+
+def order_clusters(locations, clusters):
+    """ترتیب بازدید خوشه‌ها با حل تور روی مراکز خوشه‌ها (فاصله دایره عظیمه)"""
+    if len(clusters) == 1:
+        return [0]
+    points = np.asarray(locations, dtype=float)
+    centroids = [points[0]] + [points[indices].mean(axis=0) for indices in clusters]
+    straight = haversine_matrix(centroids).astype(np.int64)
+    _, route = solve_transit(straight, time_limit=1)
+    if route is None:
+        return list(range(len(clusters)))
+    return [node - 1 for node in route[1:-1]]
+
+
+def _solve_cluster(transit, time_limit):
+    """بهترین مسیر باز داخل یک خوشه (با گره مجازی صفرهزینه به عنوان انبار)"""
+    size = transit.shape[0]
+    augmented = np.zeros((size + 1, size + 1), dtype=np.int64)
+    augmented[1:, 1:] = transit
+    _, route = solve_transit(augmented, time_limit=time_limit, stall_coefficient=2.5)
+    if route is None:
+        return list(range(size))
+    return [node - 1 for node in route[1:-1]]
+
+
+def _service_transit(nodes, time_matrix, station_time):
+    nodes = [int(node) for node in nodes]
+    return build_transit_matrix(time_matrix, station_time, depot=nodes.index(0) if 0 in nodes else None)
+
+
+def _merge_windows(positions, width, length):
+    windows = []
+    for p in sorted(positions):
+        start, end = max(0, p - width), min(length, p + width)
+        if windows and start <= windows[-1][1] - 1:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+    return windows
+
+
+def solve_decomposed(locations, station_time, fetch_matrix, cluster_size=150, boundary_width=8,
+                     max_workers=None, seed=0):
+    """حل مسئله‌های بسیار بزرگ با خوشه‌بندی، حل موازی خوشه‌ها و بهبود مرز خوشه‌ها
+
+    fetch_matrix(indices) ماتریس‌های فاصله و زمان زیرمجموعه‌ای از نقاط را
+    (به ترتیب indices) برمی‌گرداند یا در صورت خطا (None, None). ماتریس کامل
+    n×n هیچ‌گاه ساخته نمی‌شود. خروجی دیکشنری مسیر و زمان و فاصله یال‌های آن
+    یا None است.
+    """
+    points = np.asarray(locations, dtype=float)
+    clusters = cluster_stops(locations, cluster_size, seed)
+    clusters = [clusters[c] for c in order_clusters(locations, clusters)]
+
+    legs = {}
+    tasks = []
+    for indices in clusters:
+        distance_matrix, time_matrix = fetch_matrix(list(indices))
+        if distance_matrix is None or time_matrix is None:
+            return None
+        tasks.append((indices, distance_matrix, time_matrix))
+
+    max_workers = max_workers or min(len(tasks), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp.get_context('spawn')) as executor:
+        paths = list(executor.map(
+            _solve_cluster,
+            [_service_transit(indices, time_matrix, station_time) for indices, _, time_matrix in tasks],
+            [adaptive_time_limit(len(indices)) for indices, _, _ in tasks]
+        ))
+
+        route = [0]
+        segment_starts = []
+        for (indices, distance_matrix, time_matrix), path in zip(tasks, paths):
+            exit_point = points[route[-1]]
+            ends = haversine_matrix([exit_point], points[[indices[path[0]], indices[path[-1]]]])[0]
+            if ends[1] < ends[0]:
+                path = path[::-1]
+            for a, b in zip(path[:-1], path[1:]):
+                legs[(int(indices[a]), int(indices[b]))] = (time_matrix[a][b], distance_matrix[a][b])
+            segment_starts.append(len(route))
+            route.extend(int(indices[i]) for i in path)
+        route.append(0)
+
+        windows = _merge_windows(segment_starts + [len(route) - 1], boundary_width, len(route))
+        window_tasks = []
+        for start, end in windows:
+            nodes = route[start:end]
+            if len(set(nodes)) != len(nodes):
+                continue
+            distance_matrix, time_matrix = fetch_matrix(nodes)
+            if distance_matrix is None or time_matrix is None:
+                return None
+            window_tasks.append((start, end, nodes, distance_matrix, time_matrix))
+
+        orders = list(executor.map(
+            solve_path,
+            [_service_transit(nodes, time_matrix, station_time) for _, _, nodes, _, time_matrix in window_tasks],
+            [2] * len(window_tasks)
+        ))
+
+    for (start, end, nodes, distance_matrix, time_matrix), order in zip(window_tasks, orders):
+        route[start:end] = [nodes[i] for i in order]
+        for a, b in zip(order[:-1], order[1:]):
+            legs[(nodes[a], nodes[b])] = (time_matrix[a][b], distance_matrix[a][b])
+
+    for pair in zip(route[:-1], route[1:]):
+        if pair not in legs:
+            distance_matrix, time_matrix = fetch_matrix(list(pair))
+            if distance_matrix is None or time_matrix is None:
+                return None
+            legs[pair] = (time_matrix[0][1], distance_matrix[0][1])
+
+    pairs = list(zip(route[:-1], route[1:]))
+    return {
+        'route_points': route,
+        'travel': np.array([legs[pair][0] for pair in pairs]),
+        'distance': np.array([legs[pair][1] for pair in pairs]),
+        'clusters': len(clusters)
+    }
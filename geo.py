@@ -0,0 +1,258 @@
+import numpy as np
+
+EARTH_RADIUS = 6371000.0
+
+
+def haversine_matrix(points_a, points_b=None):
+    """فاصله دایره عظیمه (متر) بین همه نقاط به صورت برداری"""
+    a = np.radians(np.asarray(points_a, dtype=float))
+    b = a if points_b is None else np.radians(np.asarray(points_b, dtype=float))
+    lat1, lng1 = a[:, 0][:, None], a[:, 1][:, None]
+    lat2, lng2 = b[:, 0][None, :], b[:, 1][None, :]
+    h = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def nearest_neighbors_mask(distances, k):
+    """ماسک k نزدیک‌ترین همسایه هر نقطه (بدون خود نقطه)"""
+    size = distances.shape[0]
+    mask = np.zeros((size, size), dtype=bool)
+    if size < 2:
+        return mask
+    k = min(k, size - 1)
+    d = distances.astype(float, copy=True)
+    np.fill_diagonal(d, np.inf)
+    nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+    mask[np.arange(size)[:, None], nearest] = True
+    return mask
+
+
+def calibrate_estimates(distance_matrix, time_matrix, straight, known):
+    """برآورد ضریب پیچ‌وخم جاده و زمان به ازای هر متر از مسیرهای واقعی"""
+    usable = known & (straight > 0) & (distance_matrix > 0)
+    if not usable.any():
+        return 1.4, 0.12
+    detour = float(np.median(distance_matrix[usable] / straight[usable]))
+    seconds_per_meter = float(np.median(time_matrix[usable] / distance_matrix[usable]))
+    return max(detour, 1.0), seconds_per_meter
+
+
+def encode_polyline(coords, precision=5):
+    """فشرده‌سازی فهرست مختصات [lat, lng] با الگوریتم encoded polyline"""
+    factor = 10 ** precision
+    encoded = []
+    prev_lat = prev_lng = 0
+    for lat, lng in coords:
+        lat, lng = int(round(lat * factor)), int(round(lng * factor))
+        for delta in (lat - prev_lat, lng - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        prev_lat, prev_lng = lat, lng
+    return "".join(encoded)
+
+
+def decode_polyline(encoded, precision=5):
+    """بازگرداندن فهرست مختصات [lat, lng] از encoded polyline"""
+    factor = 10 ** precision
+    coords = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coords.append([lat / factor, lng / factor])
+    return coords
+
+
+def kmeans(points, k, iterations=25, seed=0):
+    """خوشه‌بندی k-means روی مختصات (طول جغرافیایی با cos عرض مقیاس می‌شود)"""
+    pts = np.asarray(points, dtype=float).copy()
+    pts[:, 1] *= np.cos(np.radians(pts[:, 0].mean()))
+    k = min(k, len(pts))
+    rng = np.random.default_rng(seed)
+    centers = pts[rng.choice(len(pts), k, replace=False)]
+    for _ in range(iterations):
+        labels = ((pts[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        updated = np.array([
+            pts[labels == c].mean(axis=0) if (labels == c).any() else centers[c]
+            for c in range(k)
+        ])
+        if np.allclose(updated, centers):
+            break
+        centers = updated
+    return labels
+
+
+def meters_per_pixel(lat, zoom):
+    """اندازه هر پیکسل نقشه وب (متر) در عرض جغرافیایی lat و سطح بزرگ‌نمایی zoom"""
+    return 156543.03392 * np.cos(np.radians(lat)) / 2 ** zoom
+
+
+def fit_zoom(points, width=1000, height=600, max_zoom=18):
+    """بیشترین سطح بزرگ‌نمایی که همه نقاط در نقشه‌ای به ابعاد width×height جا شوند"""
+    pts = np.asarray(points, dtype=float)
+    mercator = np.log(np.tan(np.pi / 4 + np.radians(pts[:, 0]) / 2))
+    y_span = np.ptp(mercator) or 1e-9
+    lng_span = np.ptp(pts[:, 1]) or 1e-9
+    lat_zoom = np.log2(height * 2 * np.pi / (256 * y_span))
+    lng_zoom = np.log2(width * 360 / (256 * lng_span))
+    return int(np.clip(np.floor(min(lat_zoom, lng_zoom)), 0, max_zoom))
+
+
+def simplify_polyline(coords, tolerance):
+    """ساده‌سازی Douglas-Peucker مختصات [lat, lng] با خطای حداکثر tolerance متر"""
+    pts = np.asarray(coords, dtype=float)
+    if len(pts) < 3 or tolerance <= 0:
+        return pts.tolist()
+    scale = np.radians(1) * EARTH_RADIUS
+    xy = np.column_stack((pts[:, 1] * np.cos(np.radians(pts[:, 0].mean())), pts[:, 0])) * scale
+
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = xy[end] - xy[start]
+        offsets = xy[start + 1:end] - xy[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.extend(((start, index), (index, end)))
+    return pts[keep].tolist()
+
+
+def points_in_polygon(points, polygon):
+    """آزمون برداری قرار داشتن نقاط [lat, lng] داخل چندضلعی (روش پرتو)"""
+    pts = np.asarray(points, dtype=float).reshape(-1, 2)
+    poly = np.asarray(polygon, dtype=float).reshape(-1, 2)
+    lat, lng = pts[:, 0], pts[:, 1]
+    inside = np.zeros(len(pts), dtype=bool)
+    j = len(poly) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(len(poly)):
+            (lat_i, lng_i), (lat_j, lng_j) = poly[i], poly[j]
+            crosses = (lat_i > lat) != (lat_j > lat)
+            crosses &= lng < (lng_j - lng_i) * (lat - lat_i) / (lat_j - lat_i) + lng_i
+            inside ^= crosses
+            j = i
+    return inside
+
+
+class GridIndex:
+    """شاخص مکانی شبکه‌ای برای جستجوی سریع نقاط بر اساس شعاع، محدوده، چندضلعی و نزدیکی
+
+    نقاط بر اساس خانه شبکه مرتب و شروع هر خانه نگه داشته می‌شود، پس هر
+    سطر از خانه‌های یک محدوده با یک برش آرایه خوانده می‌شود. نقاط بدون
+    مختصات معتبر نادیده گرفته می‌شوند. خروجی همه جستجوها شماره نقاط است.
+    """
+
+    def __init__(self, points, points_per_cell=8):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        ids = np.flatnonzero(np.isfinite(self.points).all(axis=1))
+        self.size = len(ids)
+        valid = self.points[ids]
+        if self.size == 0:
+            valid = np.zeros((1, 2))
+        self.scale = max(np.cos(np.radians(valid[:, 0].mean())), 1e-6)
+
+        self.origin = valid.min(axis=0)
+        extent = (valid.max(axis=0) - self.origin) * (1.0, self.scale)
+        count = max(self.size, 1)
+        cell = max(np.sqrt(extent[0] * extent[1] * points_per_cell / count),
+                   extent.max() * points_per_cell / count, 1e-6)
+        self.cell_size = np.array([cell, cell / self.scale])
+        self.shape = (np.floor(extent / cell).astype(int) + 1)
+
+        cells = self._cell(valid[:len(ids)])
+        flat = cells[:, 0] * self.shape[1] + cells[:, 1]
+        order = np.argsort(flat, kind='stable')
+        self._ids = ids[order]
+        self._starts = np.searchsorted(flat[order], np.arange(self.shape[0] * self.shape[1] + 1))
+
+    def _cell(self, points):
+        return np.floor((np.asarray(points, dtype=float) - self.origin) / self.cell_size).astype(int)
+
+    def _candidates(self, low, high):
+        """شماره نقاط خانه‌های شبکه که با مستطیل low تا high ([lat, lng]) همپوشانی دارند"""
+        (i0, j0), (i1, j1) = self._cell([low, high])
+        i0, j0 = max(i0, 0), max(j0, 0)
+        i1, j1 = min(i1, self.shape[0] - 1), min(j1, self.shape[1] - 1)
+        if self.size == 0 or i0 > i1 or j0 > j1:
+            return np.empty(0, dtype=np.int64)
+        rows = np.arange(i0, i1 + 1) * self.shape[1]
+        starts, ends = self._starts[rows + j0], self._starts[rows + j1 + 1]
+        return np.concatenate([self._ids[s:e] for s, e in zip(starts, ends)])
+
+    def within_bounds(self, south_west, north_east):
+        """نقاط داخل مستطیل جغرافیایی"""
+        low, high = np.asarray(south_west, dtype=float), np.asarray(north_east, dtype=float)
+        candidates = self._candidates(low, high)
+        pts = self.points[candidates]
+        return candidates[((pts >= low) & (pts <= high)).all(axis=1)]
+
+    def within_polygon(self, polygon):
+        """نقاط داخل چندضلعی (فهرست رئوس [lat, lng])"""
+        poly = np.asarray(polygon, dtype=float).reshape(-1, 2)
+        candidates = self.within_bounds(poly.min(axis=0), poly.max(axis=0))
+        return candidates[points_in_polygon(self.points[candidates], poly)]
+
+    def within_radius(self, center, radius):
+        """نقاط در فاصله radius متری از center، به ترتیب فاصله"""
+        center = np.asarray(center, dtype=float)
+        delta = np.degrees(radius / EARTH_RADIUS)
+        delta = np.array([delta, delta / max(np.cos(np.radians(center[0])), 1e-6)])
+        candidates = self._candidates(center - delta, center + delta)
+        distances = haversine_matrix([center], self.points[candidates])[0]
+        inside = distances <= radius
+        return candidates[inside][np.argsort(distances[inside], kind='stable')]
+
+    def nearest(self, point, k):
+        """k نزدیک‌ترین نقطه به point، به ترتیب فاصله"""
+        k = min(int(k), self.size)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        point = np.asarray(point, dtype=float)
+        center = self._cell([point])[0]
+        meters_per_degree = np.radians(1) * EARTH_RADIUS
+        radius = 0
+        while True:
+            low_cell, high_cell = center - radius, center + radius
+            low = self.origin + low_cell * self.cell_size
+            high = self.origin + (high_cell + 1) * self.cell_size
+            candidates = self._candidates(low + self.cell_size / 2, high - self.cell_size / 2)
+            covers_all = (low_cell <= 0).all() and (high_cell >= self.shape - 1).all()
+            if len(candidates) >= k:
+                distances = haversine_matrix([point], self.points[candidates])[0]
+                nearest = np.argpartition(distances, k - 1)[:k]
+                # نقاط بیرون از خانه‌های جستجوشده دست‌کم به اندازه فاصله تا لبه محدوده دورترند
+                margins = np.concatenate((
+                    np.where(low_cell > 0, point - low, np.inf),
+                    np.where(high_cell < self.shape - 1, high - point, np.inf)
+                )) * np.tile([1.0, self.scale], 2) * meters_per_degree
+                if covers_all or distances[nearest].max() <= 0.99 * margins.min():
+                    return candidates[nearest[np.argsort(distances[nearest], kind='stable')]]
+            elif covers_all:
+                return np.empty(0, dtype=np.int64)
+            radius = max(1, 2 * radius)
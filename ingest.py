@@ -0,0 +1,351 @@
+import os
+import posixpath
+import re
+import zipfile
+from datetime import datetime, timedelta
+from functools import lru_cache
+from string import digits as DIGITS
+from xml.parsers import expat
+
+import numpy as np
+import pandas as pd
+
+REQUIRED_COLUMNS = ('name', 'lat', 'lng')
+INPUT_SUFFIXES = ('.xlsx', '.xlsm', '.csv', '.parquet')
+CHUNK_ROWS = 50_000
+
+EXCEL_EPOCH = datetime(1899, 12, 30)
+EXCEL_EPOCH_1904 = datetime(1904, 1, 1)
+BUILTIN_DATE_FORMATS = {
+    14: 'mm-dd-yy', 15: 'd-mmm-yy', 16: 'd-mmm', 17: 'mmm-yy', 18: 'h:mm AM/PM', 19: 'h:mm:ss AM/PM',
+    20: 'h:mm', 21: 'h:mm:ss', 22: 'm/d/yy h:mm', 45: 'mm:ss', 46: '[h]:mm:ss', 47: 'mmss.0'
+}
+_FORMAT_LITERALS = re.compile(r'".*?"|\[(?!hh?\]|mm?\]|ss?\])[^\]]*\]')
+_DATE_TOKENS = re.compile(r'(?<![_\\])[dmhysDMHYS]')
+_DURATION_FORMAT = re.compile(r'\[hh?\](:mm(:ss(\.0*)?)?)?|\[mm?\](:ss(\.0*)?)?|\[ss?\](\.0*)?', re.I)
+
+
+class LocationFileError(ValueError):
+    """فایل نمایندگی‌ها قابل استفاده نیست (قالب یا ستون‌های نادرست)"""
+
+
+def _file_format(source, name):
+    name = name or (source if isinstance(source, (str, os.PathLike)) else getattr(source, 'name', ''))
+    suffix = os.path.splitext(str(name))[1].lower()
+    if suffix not in INPUT_SUFFIXES:
+        raise LocationFileError(f"قالب فایل {suffix or name} پشتیبانی نمی‌شود؛ قالب‌های مجاز: {', '.join(INPUT_SUFFIXES)}")
+    return suffix
+
+
+class XlsxSheetReader:
+    """خواندن جریانی سطرهای اولین برگه فایل xlsx با پارسر expat (فقط‌خواندنی)
+
+    به جای ساختن شیء برای هر خانه مانند openpyxl، XML برگه تکه‌به‌تکه پارس و
+    فقط مقدار خانه‌ها برگردانده می‌شود؛ رشته‌های مشترک و قالب‌های عددی یک بار
+    خوانده می‌شوند. مقدارها مانند pd.read_excel تبدیل می‌شوند: خانه‌های با قالب
+    تاریخ به datetime (یا time و timedelta)، اعداد صحیح به int و خطاها به None.
+    """
+
+    BLOCK_SIZE = 1 << 20
+
+    def __init__(self, source):
+        self.source = source
+
+    def rows(self):
+        with zipfile.ZipFile(self.source) as archive:
+            sheet_path, self._epoch = self._workbook(archive)
+            self._shared = self._shared_strings(archive)
+            self._dates = self._date_styles(archive)
+            with archive.open(sheet_path) as sheet:
+                self._rows, self._row, self._buffer = [], [], []
+                self._column, self._type, self._style = 0, None, None
+                self._in_value, self._inline, self._phonetic = False, False, 0
+                parser = self._parser(self._start, self._end, self._data)
+                while True:
+                    block = sheet.read(self.BLOCK_SIZE)
+                    parser.Parse(block, not block)
+                    yield from self._rows
+                    self._rows.clear()
+                    if not block:
+                        break
+
+    @staticmethod
+    def _parser(start, end, data):
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = data
+        return parser
+
+    @staticmethod
+    def _local(tag):
+        return tag.rpartition(':')[2]
+
+    def _workbook(self, archive):
+        """مسیر اولین برگه در ترتیب workbook.xml و مبدأ تاریخ‌های کتاب"""
+        sheets, targets, epoch = [], {}, [EXCEL_EPOCH]
+
+        def workbook_start(tag, attrs):
+            tag = self._local(tag)
+            if tag == 'sheet':
+                sheets.append(next(value for key, value in attrs.items() if self._local(key) == 'id'))
+            elif tag == 'workbookPr' and attrs.get('date1904') in ('1', 'true'):
+                epoch[0] = EXCEL_EPOCH_1904
+
+        def rels_start(tag, attrs):
+            if self._local(tag) == 'Relationship':
+                targets[attrs['Id']] = attrs['Target']
+
+        self._parser(workbook_start, None, None).Parse(archive.read('xl/workbook.xml'), True)
+        self._parser(rels_start, None, None).Parse(archive.read('xl/_rels/workbook.xml.rels'), True)
+        if not sheets:
+            raise LocationFileError("فایل اکسل هیچ برگه‌ای ندارد")
+        target = targets[sheets[0]]
+        path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        return path, epoch[0]
+
+    def _shared_strings(self, archive):
+        if 'xl/sharedStrings.xml' not in archive.namelist():
+            return []
+        strings, parts, state = [], [], {'text': False, 'phonetic': 0}
+
+        def start(tag, attrs):
+            tag = self._local(tag)
+            if tag == 't' and not state['phonetic']:
+                state['text'] = True
+            elif tag == 'rPh':
+                state['phonetic'] += 1
+            elif tag == 'si':
+                parts.clear()
+
+        def end(tag):
+            tag = self._local(tag)
+            if tag == 't':
+                state['text'] = False
+            elif tag == 'rPh':
+                state['phonetic'] -= 1
+            elif tag == 'si':
+                strings.append(''.join(parts))
+
+        def data(text):
+            if state['text']:
+                parts.append(text)
+
+        with archive.open('xl/sharedStrings.xml') as f:
+            self._parser(start, end, data).ParseFile(f)
+        return strings
+
+    def _date_styles(self, archive):
+        """شماره سبک‌های (cellXfs) با قالب تاریخ؛ مقدار True برای قالب‌های مدت مانند [h]:mm"""
+        if 'xl/styles.xml' not in archive.namelist():
+            return {}
+        formats, styles, state = dict(BUILTIN_DATE_FORMATS), [], {'cell_xfs': False}
+
+        def start(tag, attrs):
+            tag = self._local(tag)
+            if tag == 'numFmt':
+                formats[int(attrs['numFmtId'])] = attrs.get('formatCode')
+            elif tag == 'cellXfs':
+                state['cell_xfs'] = True
+            elif tag == 'xf' and state['cell_xfs']:
+                styles.append(int(attrs.get('numFmtId', 0)))
+
+        def end(tag):
+            if self._local(tag) == 'cellXfs':
+                state['cell_xfs'] = False
+
+        with archive.open('xl/styles.xml') as f:
+            self._parser(start, end, None).ParseFile(f)
+        return {str(index): _is_duration_format(formats[number_format])
+                for index, number_format in enumerate(styles)
+                if _is_date_format(formats.get(number_format))}
+
+    def _start(self, tag, attrs):
+        if ':' in tag:
+            tag = self._local(tag)
+        if tag == 'c':
+            ref = attrs.get('r')
+            self._column = _column_index(ref.rstrip(DIGITS)) if ref else len(self._row)
+            self._type = attrs.get('t')
+            self._style = attrs.get('s', '0')
+        elif tag == 'v':
+            self._in_value = True
+            self._buffer = []
+        elif tag == 't':
+            # متن رشته درون‌خطی ممکن است در چند تکه (r) باشد؛ تلفظ (rPh) جزو مقدار نیست
+            self._in_value = self._inline and not self._phonetic
+        elif tag == 'is':
+            self._inline = True
+            self._buffer = []
+        elif tag == 'rPh':
+            self._phonetic += 1
+        elif tag == 'row':
+            self._row = []
+
+    def _end(self, tag):
+        if ':' in tag:
+            tag = self._local(tag)
+        if tag == 'v':
+            self._in_value = False
+            self._set_value(''.join(self._buffer))
+        elif tag == 'row':
+            self._rows.append(self._row)
+        elif tag == 't':
+            self._in_value = False
+        elif tag == 'is':
+            self._inline = False
+            self._set_value(''.join(self._buffer))
+        elif tag == 'rPh':
+            self._phonetic -= 1
+
+    def _set_value(self, text):
+        kind = self._type
+        if kind is None or kind == 'n':
+            if not text:
+                value = None
+            elif self._style in self._dates:
+                value = _excel_date(float(text), self._epoch, self._dates[self._style])
+            elif text.isdigit():
+                value = int(text)
+            else:
+                value = float(text)
+                if value.is_integer():
+                    value = int(value)
+        elif kind == 's':
+            value = self._shared[int(text)]
+        elif kind == 'b':
+            value = text == '1'
+        elif kind == 'e':
+            value = None
+        elif kind == 'd':
+            value = datetime.fromisoformat(text.rstrip('Z'))
+        else:
+            value = text
+        row, column = self._row, self._column
+        if column >= len(row):
+            row.extend([None] * (column - len(row) + 1))
+        row[column] = value
+
+    def _data(self, text):
+        if self._in_value:
+            self._buffer.append(text)
+
+
+def _is_date_format(code):
+    """آیا قالب عددی اکسل تاریخ یا زمان است (مانند openpyxl)"""
+    if code is None:
+        return False
+    code = _FORMAT_LITERALS.sub('', code.split(';')[0])
+    return _DATE_TOKENS.search(code) is not None
+
+
+def _is_duration_format(code):
+    return code is not None and _DURATION_FORMAT.search(code.split(';')[0]) is not None
+
+
+def _excel_date(value, epoch, duration=False):
+    """تبدیل عدد سریال اکسل به datetime (یا time برای کسر روز و timedelta برای مدت)"""
+    if duration:
+        return timedelta(milliseconds=round(value * 86_400_000))
+    day, fraction = divmod(value, 1)
+    diff = timedelta(milliseconds=round(fraction * 86_400_000))
+    if 0 <= value < 1 and diff.days == 0:
+        return (datetime.min + diff).time()
+    if 0 < value < 60 and epoch == EXCEL_EPOCH:
+        # اکسل سال ۱۹۰۰ را به اشتباه کبیسه می‌داند؛ پیش از ۱ مارس یک روز جابه‌جا می‌شود
+        day += 1
+    return epoch + timedelta(days=day) + diff
+
+
+@lru_cache(maxsize=None)
+def _column_index(letters):
+    """شماره ستون (از صفر) از حروف نشانی خانه مانند 'AB'"""
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+def _excel_chunks(source, chunk_rows):
+    rows = XlsxSheetReader(source).rows()
+    header = next((row for row in rows if row), None)
+    if header is None:
+        return
+    header = [str(col) if col is not None else f"Unnamed: {i}" for i, col in enumerate(header)]
+    width = len(header)
+    chunk = []
+    for row in rows:
+        if not row:
+            # سطرهای خالی (مثلاً فقط قالب‌بندی‌شده) مانند pd.read_excel نادیده گرفته می‌شوند
+            continue
+        chunk.append(row[:width] + [None] * (width - len(row)))
+        if len(chunk) >= chunk_rows:
+            yield pd.DataFrame(chunk, columns=header)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=header)
+
+
+def _parquet_chunks(source, chunk_rows):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise LocationFileError("برای خواندن فایل Parquet بسته pyarrow لازم است")
+    for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_rows):
+        yield batch.to_pandas()
+
+
+def iter_location_chunks(source, name=None, chunk_rows=CHUNK_ROWS):
+    """خواندن تکه‌به‌تکه فایل نمایندگی‌ها (CSV، Parquet یا اکسل) به صورت DataFrame
+
+    source مسیر فایل یا شیء فایل است؛ قالب از پسوند name (یا نام source) تشخیص داده می‌شود.
+    """
+    suffix = _file_format(source, name)
+    if suffix == '.csv':
+        yield from pd.read_csv(source, chunksize=chunk_rows)
+    elif suffix == '.parquet':
+        yield from _parquet_chunks(source, chunk_rows)
+    else:
+        yield from _excel_chunks(source, chunk_rows)
+
+
+def clean_location_chunk(chunk):
+    """بررسی ستون‌های name/lat/lng یک تکه و حذف سطرهای بدون نام یا مختصات معتبر"""
+    chunk.columns = [str(col).strip() for col in chunk.columns]
+    missing = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+    if missing:
+        raise LocationFileError(f"فایل باید شامل ستون‌های {', '.join(map(repr, REQUIRED_COLUMNS))} باشد؛ "
+                                f"ستون‌های {', '.join(map(repr, missing))} پیدا نشد")
+    names = chunk['name'].astype('string').str.strip()
+    lat = pd.to_numeric(chunk['lat'], errors='coerce').astype(np.float32)
+    lng = pd.to_numeric(chunk['lng'], errors='coerce').astype(np.float32)
+    valid = (names.notna() & (names != '') & lat.between(-90, 90) & lng.between(-180, 180)).to_numpy()
+    return chunk.loc[valid].assign(name=names[valid], lat=lat[valid], lng=lng[valid])
+
+
+def read_locations(source, name=None, chunk_rows=CHUNK_ROWS):
+    """خواندن، اعتبارسنجی و فشرده‌سازی فایل نمایندگی‌ها؛ خروجی (DataFrame، گزارش)
+
+    فایل تکه‌به‌تکه خوانده می‌شود، سطرهای نامعتبر و مختصات تکراری (نگهداری
+    اولین مورد) حذف و ستون‌ها به float32 و category تبدیل می‌شوند. گزارش
+    شامل تعداد کل سطرها، سطرهای نامعتبر و تکراری است.
+    """
+    rows, chunks = 0, []
+    for chunk in iter_location_chunks(source, name, chunk_rows):
+        rows += len(chunk)
+        chunks.append(clean_location_chunk(chunk))
+    if not chunks:
+        raise LocationFileError("فایل خالی است")
+
+    df = pd.concat(chunks, ignore_index=True)
+    valid = len(df)
+    keys = (df['lat'].to_numpy().view(np.uint32).astype(np.uint64) << np.uint64(32)) | \
+        df['lng'].to_numpy().view(np.uint32).astype(np.uint64)
+    df = df.loc[~pd.Index(keys).duplicated()].reset_index(drop=True)
+    # ستون‌های متنی با مقادیر تکراری (مانند شهر) به صورت category نگه داشته می‌شوند
+    for col in df.columns.drop(['lat', 'lng']):
+        if not pd.api.types.is_numeric_dtype(df[col]) and df[col].nunique() < len(df) // 2:
+            df[col] = df[col].astype('category')
+
+    return df, {'rows': rows, 'invalid': rows - valid, 'duplicates': valid - len(df)}
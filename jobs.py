@@ -0,0 +1,149 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from planner import RoutePlanner, plan_route
+from scenarios import run_sweep
+
+
+class QueueFull(Exception):
+    """صف کارها پر است"""
+
+
+class PlanFailed(Exception):
+    """مسیر بهینه محاسبه نشد (مثلاً خطای API یا نبود جواب)"""
+
+
+def instance_key(locations, location_names, station_time, start_time_str, options):
+    """شناسه یکتای هر مسئله برای اشتراک نتیجه بین درخواست‌های یکسان"""
+    payload = json.dumps(
+        [[list(map(float, loc)) for loc in locations], list(location_names),
+         int(station_time), start_time_str, options],
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class Job:
+    """وضعیت، پیشرفت و نتیجه یک کار در صف"""
+
+    def __init__(self, key):
+        self.key = key
+        self.status = 'queued'
+        self.progress = (0, 0)
+        self.messages = []
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+
+class JobQueue:
+    """صف محدود کارهای پس‌زمینه با نگهداری نتیجه‌ها بر اساس شناسه مسئله"""
+
+    def __init__(self, max_workers=2, max_pending=8, result_ttl=3600, max_results=64, failure_ttl=60):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.failure_ttl = failure_ttl
+        self.max_results = max_results
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='nova-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def submit(self, key, fn, *args):
+        """ثبت کار؛ اگر همین مسئله در صف یا حل‌شده باشد همان کار برگردانده می‌شود"""
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(key)
+            if job is not None and job.status != 'failed':
+                self._jobs.move_to_end(key)
+                return job
+
+            active = sum(not job.done for job in self._jobs.values())
+            if active >= self.max_workers + self.max_pending:
+                raise QueueFull("صف محاسبه پر است؛ لطفاً کمی بعد دوباره تلاش کنید")
+
+            job = Job(key)
+            self._jobs[key] = job
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        job.status = 'running'
+        try:
+            job.result = fn(job, *args)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        job.finished = time.time()
+
+    def _expire(self):
+        """حذف نتیجه‌های قدیمی؛ کارهای ناموفق فقط تا نمایش خطا (failure_ttl) نگه داشته می‌شوند"""
+        now = time.time()
+        for key in [key for key, job in self._jobs.items()
+                    if job.done and now - job.finished > (self.failure_ttl if job.error else self.result_ttl)]:
+            del self._jobs[key]
+        finished = [key for key, job in self._jobs.items() if job.done]
+        for key in finished[:max(0, len(finished) - self.max_results)]:
+            del self._jobs[key]
+
+
+class JobPlanner(RoutePlanner):
+    """مسیریاب داخل کار پس‌زمینه که پیام‌ها و پیشرفت را در Job ثبت می‌کند"""
+
+    def __init__(self, job, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.job = job
+
+    def notify(self, level, message):
+        self.job.messages.append((level, message))
+
+    def progress_update(self, count, total):
+        self.job.progress = (count, total)
+
+
+def run_plan_job(job, api_key, planner_options, locations, location_names, station_time, start_time_str,
+                 plan_options, registry=None):
+    """اجرای کامل مسیریابی در پس‌زمینه و پیش‌دریافت هندسه مسیرهای نهایی برای نقشه
+
+    شاخص‌های کارایی این کار در registry (شاخص‌های تجمعی کل برنامه) نیز افزوده می‌شوند.
+    """
+    planner = JobPlanner(job, api_key, **planner_options)
+    try:
+        results = plan_route(planner, locations, location_names, station_time, start_time_str, **plan_options)
+        if results is None:
+            # کار ناموفق به عنوان نتیجه نگه داشته نمی‌شود؛ ارسال دوباره همین مسئله آن را از نو حل می‌کند
+            raise PlanFailed("مسیر بهینه محاسبه نشد؛ پیام‌های بالا را بررسی کنید")
+        with planner.metrics.phase('prefetch'):
+            planner.prefetch_route_legs(locations, results['route_points'])
+    finally:
+        if registry is not None:
+            registry.merge(planner.metrics)
+    return {
+        'results': results,
+        'last_matrix': planner.last_matrix,
+        'legs': planner.leg_store,
+        'metrics': planner.metrics
+    }
+
+
+def run_sweep_job(job, time_matrix, distance_matrix, subsets, services, start_times, routes=None):
+    """اجرای مقایسه سناریوها در پس‌زمینه؛ پیشرفت بر حسب زیرمجموعه‌های حل‌شده"""
+    def progress(count, total):
+        job.progress = (count, total)
+
+    return run_sweep(time_matrix, distance_matrix, subsets, services, start_times, routes=routes,
+                     progress=progress)
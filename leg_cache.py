@@ -0,0 +1,352 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get("NOVA_CACHE_DIR", ".nova_cache"), "legs.sqlite3")
+DEFAULT_CHECKPOINT_DIR = os.path.join(
+    os.environ.get("NOVA_CACHE_DIR", ".nova_cache"), "checkpoints")
+DEFAULT_MATRIX_DIR = os.path.join(
+    os.environ.get("NOVA_CACHE_DIR", ".nova_cache"), "matrices")
+# پیوندهای سخت موقتی که فرایندهای حل به فایل ماتریس نگه می‌دارند (solver._shared_matrix)
+PIN_SUFFIX = '.pin'
+
+
+def location_set_key(locations, vehicle_type):
+    """هش مجموعه مرتب نقاط و نوع وسیله نقلیه برای نام‌گذاری فایل ماتریس‌ها"""
+    payload = json.dumps([vehicle_type, [list(map(float, loc)) for loc in locations]])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LegCache:
+    """کش پایدار مسیرهای دریافت‌شده از نشان با انقضای زمانی و حذف LRU"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=24 * 3600, max_entries=200_000, precision=5):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS legs (
+                key TEXT PRIMARY KEY,
+                distance INTEGER NOT NULL,
+                duration INTEGER NOT NULL,
+                coords TEXT NOT NULL,
+                steps TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS legs_accessed ON legs(accessed)")
+        self._conn.commit()
+
+    def make_key(self, start_coords, end_coords, vehicle_type):
+        """کلید هر مسیر بر اساس مختصات گردشده و نوع وسیله نقلیه"""
+        p = self.precision
+        return (f"{vehicle_type}:"
+                f"{round(float(start_coords[0]), p)},{round(float(start_coords[1]), p)}:"
+                f"{round(float(end_coords[0]), p)},{round(float(end_coords[1]), p)}")
+
+    def get(self, start_coords, end_coords, vehicle_type, require_geometry=False):
+        """خواندن مسیر از کش؛ در صورت نبود یا انقضا None برمی‌گرداند"""
+        key = self.make_key(start_coords, end_coords, vehicle_type)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT distance, duration, coords, steps, created FROM legs WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            distance, duration, coords, steps, created = row
+            if require_geometry and coords == '[]':
+                return None
+            if self.ttl is not None and now - created > self.ttl:
+                self._conn.execute("DELETE FROM legs WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE legs SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(coords), distance, duration, json.loads(steps)
+
+    def get_legs(self, locations, vehicle_type):
+        """خواندن همه مسیرهای کش‌شده بین نقاط یک مجموعه با یک پرس‌وجو
+
+        خروجی آرایه‌های اندیس مبدأ، اندیس مقصد، فاصله و زمان است. مسیرهای هر
+        مبدأ با بازه‌ای از کلید اصلی خوانده می‌شوند، پس کش خالی هزینه‌ای ندارد.
+        """
+        p = self.precision
+        points = {}
+        for index, loc in enumerate(locations):
+            points.setdefault(f"{round(float(loc[0]), p)},{round(float(loc[1]), p)}", []).append(index)
+        min_created = time.time() - self.ttl if self.ttl is not None else float('-inf')
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS origins (low TEXT PRIMARY KEY, high TEXT NOT NULL)")
+            self._conn.execute("DELETE FROM origins")
+            # پس از مبدأ در کلید ':' می‌آید و ';' نویسه بعدی است
+            self._conn.executemany("INSERT INTO origins VALUES (?, ?)",
+                                   [(f"{vehicle_type}:{point}:", f"{vehicle_type}:{point};") for point in points])
+            rows = self._conn.execute(
+                "SELECT origins.low, legs.key, legs.distance, legs.duration FROM origins "
+                "JOIN legs ON legs.key >= origins.low AND legs.key < origins.high "
+                "WHERE legs.created >= ?",
+                (min_created,)
+            ).fetchall()
+            self._conn.execute("DELETE FROM origins")
+            found = [(low, key, distance, duration) for low, key, distance, duration in rows
+                     if key[len(low):] in points]
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE legs SET accessed = ? WHERE key = ?",
+                    [(now, key) for _, key, _, _ in found]
+                )
+            self._conn.commit()
+
+        origin_at = len(vehicle_type) + 1
+        legs = [(i, j, distance, duration)
+                for low, key, distance, duration in found
+                for i in points[low[origin_at:-1]]
+                for j in points[key[len(low):]]]
+        if not legs:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty, empty
+        return tuple(np.array(column, dtype=np.int64) for column in zip(*legs))
+
+    def put(self, start_coords, end_coords, vehicle_type, route_coords, distance, duration, steps):
+        """ذخیره مسیر در کش و حذف قدیمی‌ترین موارد در صورت عبور از سقف"""
+        key = self.make_key(start_coords, end_coords, vehicle_type)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO legs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, int(distance), int(duration),
+                 json.dumps(route_coords), json.dumps(steps or []), now, now)
+            )
+            self._evict(1)
+            self._conn.commit()
+
+    def put_many(self, entries, vehicle_type):
+        """ذخیره فاصله و زمان چند مسیر بدون هندسه؛ هندسه موجود در کش حفظ می‌شود"""
+        now = time.time()
+        rows = [
+            (self.make_key(start, end, vehicle_type), int(distance), int(duration), now, now)
+            for start, end, distance, duration in entries
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO legs VALUES (?, ?, ?, '[]', '[]', ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET distance = excluded.distance, "
+                "duration = excluded.duration, created = excluded.created, accessed = excluded.accessed",
+                rows
+            )
+            self._evict(len(rows))
+            self._conn.commit()
+
+    def _evict(self, written):
+        """حذف کم‌استفاده‌ترین موارد تا سقف max_entries پس از هر نوشتن
+
+        موارد منقضی هنگام خواندن نادیده گرفته می‌شوند و هر ۲۵۶ نوشتن یک بار پاک می‌شوند.
+        """
+        self._writes += written
+        if self.ttl is not None and self._writes >= 256:
+            self._writes = 0
+            self._conn.execute("DELETE FROM legs WHERE created < ?", (time.time() - self.ttl,))
+        if self.max_entries is not None:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM legs").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM legs WHERE key IN "
+                    "(SELECT key FROM legs ORDER BY accessed ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def clear(self):
+        """پاک کردن کامل کش"""
+        with self._lock:
+            self._conn.execute("DELETE FROM legs")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM legs").fetchone()
+        return count
+
+
+class MatrixCheckpoint:
+    """ذخیره دوره‌ای ماتریس نیمه‌کاره روی دیسک تا ساخت قطع‌شده از همان‌جا ادامه یابد"""
+
+    def __init__(self, directory=DEFAULT_CHECKPOINT_DIR, interval=5.0, ttl=24 * 3600):
+        self.directory = directory
+        self.interval = interval
+        self.ttl = ttl
+        self._saved = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, locations, vehicle_type):
+        """مسیر فایل هر ماتریس بر اساس هش مجموعه نقاط و نوع وسیله نقلیه"""
+        return os.path.join(self.directory, f"{location_set_key(locations, vehicle_type)}.npz")
+
+    def load(self, locations, vehicle_type):
+        """خواندن ماتریس ذخیره‌شده؛ در صورت نبود، انقضا یا ناسازگاری None"""
+        path = self.path(locations, vehicle_type)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with np.load(path) as data:
+                saved = {name: data[name] for name in ('distance_matrix', 'time_matrix', 'known')}
+        except (OSError, ValueError, KeyError):
+            return None
+        size = len(locations)
+        if any(value.shape != (size, size) for value in saved.values()):
+            return None
+        return saved
+
+    def save(self, locations, vehicle_type, distance_matrix, time_matrix, known, force=False):
+        """نوشتن اتمی ماتریس (حداکثر یک بار در هر interval ثانیه مگر با force)"""
+        path = self.path(locations, vehicle_type)
+        now = time.monotonic()
+        if not force and now - self._saved.get(path, float('-inf')) < self.interval:
+            return
+        self._saved[path] = now
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, distance_matrix=distance_matrix, time_matrix=time_matrix, known=known)
+        os.replace(temp_path, path)
+
+    def discard(self, locations, vehicle_type):
+        """حذف نقطه بازیابی پس از تکمیل ماتریس"""
+        path = self.path(locations, vehicle_type)
+        self._saved.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class MatrixStore:
+    """ماتریس‌های کامل فاصله و زمان به صورت int32 روی دیسک، نگاشته در حافظه و فقط‌خواندنی
+
+    هر ماتریس بر اساس هش مجموعه نقاط و نوع وسیله نقلیه در فایل‌های .npy
+    ذخیره می‌شود. همه نشست‌های یک فرایند از همان نگاشت استفاده می‌کنند و
+    فرایندهای دیگر همان صفحه‌های فایل را از کش سیستم‌عامل می‌خوانند، پس
+    حافظه با تعداد کاربران زیاد نمی‌شود. known خانه‌هایی را مشخص می‌کند که
+    از API یا کش دریافت شده‌اند (بقیه برآوردند).
+    """
+
+    ARRAYS = (('distance_matrix', np.int32), ('time_matrix', np.int32), ('known', np.bool_))
+
+    def __init__(self, directory=DEFAULT_MATRIX_DIR, ttl=7 * 24 * 3600, max_entries=16, max_open=8):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, name):
+        return os.path.join(self.directory, f"{key}.{name}.npy")
+
+    def load(self, locations, vehicle_type):
+        """نگاشت فقط‌خواندنی ماتریس‌های ذخیره‌شده؛ در صورت نبود، انقضا یا ناسازگاری None"""
+        key = location_set_key(locations, vehicle_type)
+        with self._lock:
+            entry = self._open.get(key)
+            if entry is not None:
+                self._open.move_to_end(key)
+                return entry
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(self._path(key, 'known')) > self.ttl:
+                return None
+            arrays = {name: np.load(self._path(key, name), mmap_mode='r') for name, _ in self.ARRAYS}
+        except (OSError, ValueError):
+            return None
+        size = len(locations)
+        if any(value.shape != (size, size) for value in arrays.values()):
+            return None
+
+        entry = dict(arrays, locations=list(locations), vehicle_type=vehicle_type, key=key)
+        with self._lock:
+            entry = self._open.setdefault(key, entry)
+            self._open.move_to_end(key)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return entry
+
+    def save(self, locations, vehicle_type, distance_matrix, time_matrix, known):
+        """نوشتن اتمی ماتریس‌ها به صورت فشرده؛ خروجی نگاشت فقط‌خواندنی آن‌ها
+
+        نگاشت‌های قبلی همین مجموعه نقاط تا پایان استفاده معتبر می‌مانند
+        (فایل جدید جایگزین می‌شود و فایل قبلی تا بسته شدن نگاشت باقی است).
+        """
+        key = location_set_key(locations, vehicle_type)
+        values = {'distance_matrix': distance_matrix, 'time_matrix': time_matrix, 'known': known}
+        # known آخر نوشته می‌شود چون زمان تغییر آن ملاک انقضاست
+        for name, dtype in self.ARRAYS:
+            path = self._path(key, name)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                np.save(f, np.asarray(values[name]).astype(dtype, copy=False))
+            os.replace(temp_path, path)
+        with self._lock:
+            self._open.pop(key, None)
+        self._prune()
+        return self.load(locations, vehicle_type)
+
+    def _prune(self):
+        """حذف ماتریس‌های منقضی و قدیمی‌ترین‌ها بیش از max_entries
+
+        فایل‌ها با os.remove حذف می‌شوند؛ نگاشت‌های باز و پیوندهای PIN_SUFFIX
+        فرایندهای حل تا پایان کارشان همان داده را نگه می‌دارند. پیوندهایی که
+        (مثلاً با توقف ناگهانی فرایند) جا مانده‌اند پس از ttl حذف می‌شوند.
+        """
+        try:
+            listing = os.listdir(self.directory)
+        except OSError:
+            return
+        now = time.time()
+        for name in listing:
+            if name.endswith(PIN_SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    # ساخت پیوند ctime را به‌روز می‌کند، پس پیوندهای در حال استفاده جوان‌اند
+                    if now - os.stat(path).st_ctime > (self.ttl or 24 * 3600):
+                        os.remove(path)
+                except OSError:
+                    pass
+        names = [name for name in listing if name.endswith('.known.npy')]
+        entries = []
+        for name in names:
+            try:
+                entries.append((os.path.getmtime(os.path.join(self.directory, name)), name[:-len('.known.npy')]))
+            except OSError:
+                continue
+        entries.sort(reverse=True)
+        for position, (mtime, key) in enumerate(entries):
+            if position < self.max_entries and (self.ttl is None or now - mtime <= self.ttl):
+                continue
+            with self._lock:
+                self._open.pop(key, None)
+            for name, _ in self.ARRAYS:
+                try:
+                    os.remove(self._path(key, name))
+                except OSError:
+                    pass
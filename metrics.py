@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PHASE_BUCKETS = (0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+class Metrics:
+    """ثبت شمارنده‌ها، هیستوگرام‌ها و سری‌های زمانی کارایی (امن برای چند نخ)"""
+
+    def __init__(self, max_series=1000):
+        self.max_series = max_series
+        self.started = time.monotonic()
+        self._counters = {}
+        self._histograms = {}
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        """افزایش شمارنده name با برچسب‌های labels"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """ثبت یک مقدار در هیستوگرام name"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = {'buckets': tuple(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+                self._histograms[key] = histogram
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def record(self, name, value, at=None):
+        """افزودن نقطه (زمان از شروع، مقدار) به سری زمانی name"""
+        at = time.monotonic() - self.started if at is None else at
+        with self._lock:
+            series = self._series.setdefault(name, [])
+            series.append((round(float(at), 3), float(value)))
+            del series[:-self.max_series]
+
+    def total(self, name, **labels):
+        """مجموع شمارنده name روی همه برچسب‌هایی که با labels سازگارند"""
+        wanted = set(_label_key(labels))
+        with self._lock:
+            return sum(value for (counter, key), value in self._counters.items()
+                       if counter == name and wanted <= set(key))
+
+    @contextmanager
+    def phase(self, name):
+        """اندازه‌گیری زمان اجرای یک مرحله"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('nova_phase_seconds', time.perf_counter() - started, buckets=PHASE_BUCKETS, phase=name)
+
+    def merge(self, other):
+        """افزودن مقادیر یک Metrics دیگر (سری‌ها جایگزین می‌شوند)"""
+        with other._lock:
+            counters = dict(other._counters)
+            histograms = {key: dict(value, counts=list(value['counts'])) for key, value in other._histograms.items()}
+            series = {name: list(values) for name, values in other._series.items()}
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, value in histograms.items():
+                histogram = self._histograms.get(key)
+                if histogram is None or histogram['buckets'] != value['buckets']:
+                    self._histograms[key] = value
+                    continue
+                histogram['counts'] = [a + b for a, b in zip(histogram['counts'], value['counts'])]
+                histogram['sum'] += value['sum']
+                histogram['count'] += value['count']
+            self._series.update(series)
+
+    def snapshot(self):
+        """همه داده‌ها به صورت ساختار قابل تبدیل به JSON"""
+        with self._lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                'histograms': [
+                    {'name': name, 'labels': dict(labels),
+                     'buckets': dict(zip(map(str, h['buckets']), h['counts'])),
+                     'sum': round(h['sum'], 6), 'count': h['count']}
+                    for (name, labels), h in sorted(self._histograms.items())
+                ],
+                'series': {name: [list(point) for point in values] for name, values in self._series.items()}
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """خروجی در قالب متنی Prometheus (آخرین مقدار هر سری به صورت gauge)"""
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), h in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                for bound, count in zip(h['buckets'], h['counts']):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {h['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {h['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {h['count']}")
+            for name, values in sorted(self._series.items()):
+                if values:
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {values[-1][1]}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,179 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from geo import haversine_matrix
+
+
+class MockNeshanServer:
+    """سرور محلی شبیه API نشان (مسیریابی و ماتریس فاصله) برای سنجش کارایی بدون اینترنت
+
+    فاصله جاده‌ای برابر فاصله دایره عظیمه ضربدر detour و زمان سفر برابر
+    فاصله تقسیم بر speed (متر بر ثانیه) است. هر پاسخ به طور میانگین latency
+    ثانیه (با نوسان نسبی jitter) تأخیر دارد و با احتمال error_rate خطای
+    429 یا 503 برمی‌گرداند.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.5, error_rate=0.0,
+                 detour=1.3, speed=8.3, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.detour = detour
+        self.speed = speed
+        self.counts = {'direction': 0, 'distance-matrix': 0, 'errors': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def direction_url(self):
+        return f"{self.base_url}/v4/direction"
+
+    @property
+    def distance_matrix_url(self):
+        return f"{self.base_url}/v1/distance-matrix"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """اجرای سرور در نخ جاری تا توقف با Ctrl+C"""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _draw(self):
+        """کد خطای تصادفی (یا None) و تأخیر پاسخ بعدی"""
+        with self._lock:
+            error = self._random.choice([429, 503]) if self._random.random() < self.error_rate else None
+            delay = self.latency * (1 + self.jitter * (2 * self._random.random() - 1))
+        return error, max(0.0, delay)
+
+    def _leg(self, origin, destination):
+        distance = float(haversine_matrix([origin], [destination])[0, 0]) * self.detour
+        return int(distance), int(distance / self.speed)
+
+    def direction(self, origin, destination, steps=4):
+        """پاسخ هم‌شکل /v4/direction با چند گام روی خط راست بین دو نقطه"""
+        distance, duration = self._leg(origin, destination)
+        points = [
+            [origin[1] + (destination[1] - origin[1]) * k / steps,
+             origin[0] + (destination[0] - origin[0]) * k / steps]
+            for k in range(steps + 1)
+        ]
+        return {'routes': [{'legs': [{
+            'distance': {'value': distance},
+            'duration': {'value': duration},
+            'steps': [
+                {'start_location': points[k], 'end_location': points[k + 1],
+                 'duration': {'value': duration // steps}, 'distance': {'value': distance // steps}}
+                for k in range(steps)
+            ]
+        }]}]}
+
+    def distance_matrix(self, origins, destinations):
+        """پاسخ هم‌شکل /v1/distance-matrix"""
+        distances = haversine_matrix(origins, destinations) * self.detour
+        return {'status': 'Ok', 'rows': [
+            {'elements': [
+                {'status': 'Ok', 'distance': {'value': int(d)}, 'duration': {'value': int(d / self.speed)}}
+                for d in row
+            ]}
+            for row in distances
+        ]}
+
+    def _handler(self):
+        server = self
+
+        def parse_points(value):
+            return [tuple(map(float, point.split(','))) for point in value.split('|')]
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                error, delay = server._draw()
+                time.sleep(delay)
+                try:
+                    if error:
+                        with server._lock:
+                            server.counts['errors'] += 1
+                        self._send(error, {'status': 'ERROR'}, {'Retry-After': '0'})
+                    elif url.path.endswith('/direction'):
+                        with server._lock:
+                            server.counts['direction'] += 1
+                        self._send(200, server.direction(parse_points(query['origin'])[0],
+                                                         parse_points(query['destination'])[0]))
+                    elif url.path.endswith('/distance-matrix'):
+                        with server._lock:
+                            server.counts['distance-matrix'] += 1
+                        self._send(200, server.distance_matrix(parse_points(query['origins']),
+                                                               parse_points(query['destinations'])))
+                    else:
+                        self._send(404, {'status': 'NOT_FOUND'})
+                except (KeyError, ValueError):
+                    self._send(400, {'status': 'INVALID_ARGUMENT'})
+
+            def _send(self, status, body, headers=None):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="سرور محلی شبیه API نشان")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="میانگین تأخیر هر پاسخ (ثانیه)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="احتمال پاسخ خطای 429/503")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = MockNeshanServer(args.host, args.port, latency=args.latency, error_rate=args.error_rate,
+                              seed=args.seed)
+    print(f"direction: {server.direction_url}\ndistance-matrix: {server.distance_matrix_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+DIRECTION_URL = "https://api.neshan.org/v4/direction"
+DISTANCE_MATRIX_URL = "https://api.neshan.org/v1/distance-matrix"
+
+
+class NeshanError(Exception):
+    """خطای دریافت پاسخ معتبر از API نشان"""
+
+
+class TransientNeshanError(NeshanError):
+    """خطای گذرا (محدودیت نرخ یا خطای سرور) که ارزش تلاش دوباره دارد"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class NeshanAuthError(NeshanError):
+    """کلید API نامعتبر یا بدون دسترسی؛ ادامه درخواست‌ها بی‌فایده است"""
+
+
+def check_response(response, service):
+    """تبدیل وضعیت‌های خطای پاسخ به استثنای مناسب"""
+    if response.status_code == 200:
+        return
+    message = f"خطای {response.status_code} از {service} نشان"
+    if response.status_code in (401, 403):
+        raise NeshanAuthError(message)
+    if response.status_code == 429 or response.status_code >= 500:
+        retry_after = response.headers.get('Retry-After')
+        try:
+            retry_after = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            retry_after = None
+        raise TransientNeshanError(message, retry_after)
+    raise NeshanError(message)
+
+
+def call_with_retry(fn, *args, retries=4, base_delay=0.5, max_delay=30.0, metrics=None):
+    """اجرای fn با تلاش دوباره برای خطاهای گذرا و شبکه (عقب‌نشینی نمایی با jitter کامل)"""
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args)
+        except (TransientNeshanError, requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            if metrics is not None:
+                metrics.count('nova_api_retries_total', reason=type(e).__name__)
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None:
+                delay = max(delay, min(max_delay, retry_after))
+            time.sleep(delay)
+
+
+class TokenBucket:
+    """محدودکننده نرخ درخواست‌ها به روش سطل توکن (امن برای چند نخ)"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """انتظار تا آزاد شدن یک توکن"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(api_key, pool_size=8, metrics=None):
+    """ساخت نشست HTTP با اتصال‌های ماندگار برای استفاده مشترک بین نخ‌ها
+
+    با دادن metrics تعداد درخواست‌ها (به تفکیک سرویس و کد وضعیت) و
+    هیستوگرام زمان پاسخ هر سرویس ثبت می‌شود.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({'Api-Key': api_key})
+
+    if metrics is not None:
+        def record_response(response, *args, **kwargs):
+            endpoint = urlparse(response.url).path.rstrip('/').rsplit('/', 1)[-1]
+            metrics.count('nova_api_requests_total', endpoint=endpoint, status=response.status_code)
+            metrics.observe('nova_api_latency_seconds', response.elapsed.total_seconds(), endpoint=endpoint)
+
+        session.hooks['response'].append(record_response)
+    return session
+
+
+def _format_points(points):
+    return "|".join(f"{lat},{lng}" for lat, lng in points)
+
+
+class DirectionMatrixProvider:
+    """ساخت ماتریس با یک درخواست مسیر به ازای هر جفت نقطه (متقارن)"""
+
+    symmetric = True
+
+    def __init__(self, fetch_leg):
+        self.fetch_leg = fetch_leg
+
+    def blocks(self, mask):
+        """یک بلوک ۱×۱ برای هر جفت مورد نیاز (هر جفت فقط یک بار)"""
+        pairs = np.triu(mask | mask.T, 1)
+        return [([int(i)], [int(j)]) for i, j in zip(*np.nonzero(pairs))]
+
+    def fetch_block(self, origins, destinations):
+        _, distance, duration, _ = self.fetch_leg(origins[0], destinations[0])
+        return np.array([[distance]]), np.array([[duration]])
+
+
+class DistanceMatrixProvider:
+    """ساخت ماتریس با درخواست‌های یکجای مبدأ × مقصد از API ماتریس فاصله نشان"""
+
+    symmetric = False
+
+    def __init__(self, session, rate_limiter, cache=None, vehicle_type='car',
+                 url=DISTANCE_MATRIX_URL, max_origins=10, max_destinations=10, timeout=30):
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.vehicle_type = vehicle_type
+        self.url = url
+        self.max_origins = max_origins
+        self.max_destinations = max_destinations
+        self.timeout = timeout
+
+    def blocks(self, mask):
+        """تقسیم جفت‌های مورد نیاز به بلوک‌هایی در اندازه سهمیه هر درخواست"""
+        size = mask.shape[0]
+        blocks = []
+        for r in range(0, size, self.max_origins):
+            rows = list(range(r, min(r + self.max_origins, size)))
+            cols = [int(c) for c in np.nonzero(mask[rows].any(axis=0))[0]]
+            for c in range(0, len(cols), self.max_destinations):
+                blocks.append((rows, cols[c:c + self.max_destinations]))
+        return blocks
+
+    def fetch_block(self, origins, destinations):
+        """دریافت فاصله و زمان برای یک بلوک مبدأ × مقصد
+
+        خانه‌هایی که مسیری برایشان یافت نشد NaN برگردانده می‌شوند.
+        """
+        params = {
+            'type': self.vehicle_type,
+            'origins': _format_points(origins),
+            'destinations': _format_points(destinations)
+        }
+        self.rate_limiter.acquire()
+        response = self.session.get(self.url, params=params, timeout=self.timeout)
+        check_response(response, "API ماتریس فاصله")
+
+        rows = response.json().get('rows') or []
+        if len(rows) != len(origins):
+            raise NeshanError("پاسخ ناقص از API ماتریس فاصله نشان")
+
+        distances = np.full((len(origins), len(destinations)), np.nan)
+        durations = np.full((len(origins), len(destinations)), np.nan)
+        entries = []
+        for r, row in enumerate(rows):
+            elements = row.get('elements') or []
+            if len(elements) != len(destinations):
+                raise NeshanError("پاسخ ناقص از API ماتریس فاصله نشان")
+            for c, element in enumerate(elements):
+                if origins[r] == destinations[c]:
+                    distances[r, c] = durations[r, c] = 0
+                    continue
+                if element.get('status', 'Ok') != 'Ok' or 'distance' not in element:
+                    continue
+                distances[r, c] = element['distance']['value']
+                durations[r, c] = element['duration']['value']
+                entries.append((origins[r], destinations[c], distances[r, c], durations[r, c]))
+
+        if self.cache is not None and entries:
+            self.cache.put_many(entries, self.vehicle_type)
+        return distances, durations
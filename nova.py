@@ -1,15 +1,27 @@
+import hashlib
+import re
 import streamlit as st
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
-import folium
-from folium import plugins
-import requests
+import streamlit.components.v1 as components
 import numpy as np
 from datetime import datetime, timedelta
 import pandas as pd
-from streamlit_folium import st_folium
-import time
 from io import BytesIO
+import folium
+from folium import plugins
+from streamlit_folium import st_folium
+from geo import GridIndex
+from ingest import INPUT_SUFFIXES, LocationFileError, read_locations
+from leg_cache import LegCache, MatrixCheckpoint, MatrixStore
+from metrics import Metrics
+from neshan import TokenBucket
+from jobs import JobQueue, QueueFull, instance_key, run_plan_job, run_sweep_job
+from planner import RoutePlanner, build_route_table
+from route_map import build_route_map, route_map_key
+from scenarios import ALL_STOPS, group_subsets, scenario_key, stop_attributes
+
+LIST_SELECTION_LIMIT = 2000
+SELECTION_MAP_POINTS = 3000
+MATRIX_WINDOW = 50
 
 st.set_page_config(
     page_title="سیستم مسیریابی هوشمند",
@@ -105,180 +117,325 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-class RouteOptimizer:
-    def __init__(self, api_key):
-        self.api_key = api_key
-        self.headers = {'Api-Key': self.api_key}
+class RouteOptimizer(RoutePlanner):
+    def notify(self, level, message):
+        getattr(st, level)(message)
 
-    def get_route_neshan(self, start_coords, end_coords):
-        """دریافت مسیر از API نشان"""
-        url = "https://api.neshan.org/v4/direction"
-        
-        origin = f"{start_coords[0]},{start_coords[1]}"
-        destination = f"{end_coords[0]},{end_coords[1]}"
-        
-        params = {
-            'type': 'car',
-            'origin': origin,
-            'destination': destination
-        }
-        
+    def route_map_html(self, results, mode='auto'):
+        """HTML نقشه مسیر (در صورت ساخت قبلی از کش)؛ در صورت خطا None"""
         try:
-            response = requests.get(url, headers=self.headers, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                if 'routes' in data and data['routes']:
-                    route = data['routes'][0]
-                    if 'legs' in route and route['legs']:
-                        leg = route['legs'][0]
-                        distance = leg['distance']['value']
-                        duration = leg['duration']['value']
-                        
-                        route_coords = []
-                        for step in leg['steps']:
-                            if 'start_location' in step:
-                                route_coords.append([
-                                    step['start_location'][1],
-                                    step['start_location'][0]
-                                ])
-                        
-                        if leg['steps'] and 'end_location' in leg['steps'][-1]:
-                            route_coords.append([
-                                leg['steps'][-1]['end_location'][1],
-                                leg['steps'][-1]['end_location'][0]
-                            ])
-                        
-                        return route_coords, distance, duration, leg['steps']
-            
-            st.warning(f"خطا در دریافت مسیر از {origin} به {destination}")
-            return None, None, None, None
-                
+            return get_route_map_html(route_map_key(results, mode), self, results, mode)
         except Exception as e:
-            st.error(f"خطا در ارتباط با API نشان: {str(e)}")
-            return None, None, None, None
-
-    def create_distance_time_matrices(self, locations):
-        """ایجاد ماتریس‌های فاصله و زمان"""
-        size = len(locations)
-        distance_matrix = np.zeros((size, size))
-        time_matrix = np.zeros((size, size))
-        
-        progress_text = st.empty()
-        progress_bar = st.progress(0)
-        total = size * (size - 1) // 2
-        count = 0
-        
-        try:
-            for i in range(size):
-                for j in range(i + 1, size):
-                    count += 1
-                    progress_text.text(f"محاسبه فواصل... {count}/{total}")
-                    progress_bar.progress(count/total)
-                    
-                    route_coords, distance, duration, _ = self.get_route_neshan(
-                        locations[i], locations[j])
-                    
-                    if distance is not None and duration is not None:
-                        distance_matrix[i][j] = distance_matrix[j][i] = distance
-                        time_matrix[i][j] = time_matrix[j][i] = duration
-                    else:
-                        st.error(f"خطا در دریافت فاصله بین نقاط {i+1} و {j+1}")
-                        return None, None
-                    
-                    time.sleep(0.5)  
-            
-            progress_text.empty()
-            progress_bar.empty()
-            return distance_matrix.astype(int), time_matrix.astype(int)
-        
-        except Exception as e:
-            st.error(f"خطا در ایجاد ماتریس‌ها: {str(e)}")
-            return None, None
+            st.error(f"خطا در ایجاد نقشه: {str(e)}")
+            return None
 
-    def create_route_map(self, locations, route_points, location_names, time_matrix, station_time, start_time_str):
-        """ایجاد نقشه مسیر با جزئیات"""
-        try:
-            center_lat = np.mean([loc[0] for loc in locations])
-            center_lng = np.mean([loc[1] for loc in locations])
-            m = folium.Map(location=[center_lat, center_lng], zoom_start=12)
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_route_map_html(route_key, _optimizer, _results, mode):
+    """ساخت HTML نقشه؛ برای هر route_key فقط یک بار ساخته و بین اجراها و کاربران مشترک است"""
+    m, _ = build_route_map(
+        _optimizer, _results['locations'], _results['route_points'], _results['location_names'],
+        _results['time_matrix'], _results['station_time'], _results['start_time_str'],
+        schedule=_results['schedule'], mode=mode
+    )
+    return m.get_root().render()
 
-            current_time = datetime.strptime(start_time_str, "%H:%M")
-            arrival_times = [start_time_str]
+@st.cache_data(max_entries=8, show_spinner="در حال خواندن فایل...")
+def load_branch_file(file_hash, file_name, _data):
+    """خواندن و اعتبارسنجی فایل نمایندگی‌ها؛ برای هر محتوای فایل (file_hash) فقط یک بار انجام می‌شود"""
+    return read_locations(BytesIO(_data), file_name)
 
-            colors = ['#1a237e', '#0d47a1', '#1565c0', '#1976d2', '#1e88e5']
+def uploaded_file_hash(uploaded_file):
+    """هش محتوای فایل آپلودشده (برای هر آپلود فقط یک بار محاسبه می‌شود)"""
+    hashes = st.session_state.setdefault('upload_hashes', {})
+    if uploaded_file.file_id not in hashes:
+        hashes.clear()
+        hashes[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    return hashes[uploaded_file.file_id]
 
-            for i in range(len(route_points)-1):
-                start = locations[route_points[i]]
-                end = locations[route_points[i+1]]
-                route_coords, distance, duration, steps = self.get_route_neshan(start, end)
-                
-                if i > 0:
-                    current_time += timedelta(seconds=station_time)
-                if duration:
-                    current_time += timedelta(seconds=int(duration))
-                arrival_times.append(current_time.strftime("%H:%M"))
-                
-                if route_coords:
-                    folium.PolyLine(
-                        route_coords,
-                        weight=4,
-                        color=colors[i % len(colors)],
-                        opacity=0.8,
-                        popup=f"""
-                        <div dir="rtl" style="font-family: Vazirmatn, sans-serif; text-align: right;">
-                            <b>مسیر {i+1}:</b><br>
-                            از: {location_names[route_points[i]]}<br>
-                            به: {location_names[route_points[i+1]]}<br>
-                            زمان حرکت: {arrival_times[i]}<br>
-                            زمان رسیدن: {arrival_times[i+1]}<br>
-                            مدت سفر: {duration/60:.0f} دقیقه<br>
-                            فاصله: {distance/1000:.1f} کیلومتر
-                        </div>
-                        """
-                    ).add_to(m)
-
-            for i, point_idx in enumerate(route_points):
-                icon_color = 'red' if i == 0 else ('green' if i == len(route_points)-1 else 'blue')
-                folium.Marker(
-                    locations[point_idx],
-                    popup=folium.Popup(
-                        f"""
-                        <div dir="rtl" style="font-family: Vazirmatn, sans-serif; text-align: right;">
-                            <b>ایستگاه {i+1}: {location_names[point_idx]}</b><br>
-                            زمان رسیدن: {arrival_times[i]}<br>
-                            {'نقطه شروع' if i == 0 else f'زمان توقف: {station_time//60} دقیقه'}
-                        </div>
-                        """,
-                        max_width=300
-                    ),
-                    icon=folium.Icon(color=icon_color)
-                ).add_to(m)
-
-            folium.LayerControl().add_to(m)
-            plugins.Fullscreen().add_to(m)
-            plugins.MousePosition().add_to(m)
-            
-            return m, arrival_times
-            
-        except Exception as e:
-            st.error(f"خطا در ایجاد نقشه: {str(e)}")
-            return None, None
+@st.cache_resource(max_entries=8, show_spinner=False)
+def get_branch_index(file_hash, _df):
+    """شاخص مکانی نمایندگی‌ها؛ برای هر محتوای فایل یک بار ساخته و بین کاربران مشترک است"""
+    return GridIndex(np.column_stack((pd.to_numeric(_df['lat'], errors='coerce'),
+                                      pd.to_numeric(_df['lng'], errors='coerce'))))
+
+def drawn_shape_rows(index, drawing):
+    """شماره نمایندگی‌های داخل یک شکل رسم‌شده (GeoJSON مستطیل یا چندضلعی)"""
+    geometry = (drawing or {}).get('geometry') or {}
+    if geometry.get('type') != 'Polygon':
+        return np.empty(0, dtype=np.int64)
+    ring = np.asarray(geometry['coordinates'][0], dtype=float)[:, ::-1]
+    low, high = ring.min(axis=0), ring.max(axis=0)
+    if len(ring) <= 5 and ((ring == low) | (ring == high)).all():
+        return index.within_bounds(low, high)
+    return index.within_polygon(ring)
+
+def select_branches(df, index, start_point):
+    """انتخاب نمایندگی‌ها با فهرست نام، نزدیکی به نقطه شروع، شعاع یا محدوده رسم‌شده؛ خروجی شماره سطرها"""
+    methods = ['نزدیک‌ترین به نقطه شروع', 'شعاع اطراف یک نقطه', 'محدوده رسم‌شده روی نقشه', 'از فهرست نام‌ها']
+    method = st.radio("روش انتخاب:", methods, index=0 if len(df) > LIST_SELECTION_LIMIT else 3,
+                      horizontal=True, key="selection_method")
+
+    if method == methods[0]:
+        k = st.number_input("تعداد نمایندگی‌ها:", min_value=1, max_value=max(index.size, 1),
+                            value=min(20, max(index.size, 1)), key="selection_k")
+        return index.nearest(start_point, k)
+
+    if method == methods[1]:
+        col1, col2, col3 = st.columns(3)
+        center_lat = col1.number_input("عرض جغرافیایی مرکز:", value=start_point[0], format="%.7f",
+                                       key="selection_center_lat")
+        center_lng = col2.number_input("طول جغرافیایی مرکز:", value=start_point[1], format="%.7f",
+                                       key="selection_center_lng")
+        radius = col3.number_input("شعاع (کیلومتر):", min_value=0.1, value=2.0, step=0.5, key="selection_radius")
+        return index.within_radius((center_lat, center_lng), radius * 1000)
+
+    if method == methods[2]:
+        st.caption("با ابزار مستطیل یا چندضلعی، محدوده نمایندگی‌های مورد نظر را روی نقشه رسم کنید.")
+        m = folium.Map(location=list(start_point), zoom_start=11, prefer_canvas=True)
+        step = max(1, len(df) // SELECTION_MAP_POINTS)
+        sample = df[['lat', 'lng']].iloc[::step].apply(pd.to_numeric, errors='coerce').dropna()
+        plugins.FastMarkerCluster(sample.to_numpy().tolist()).add_to(m)
+        folium.Marker(list(start_point), icon=folium.Icon(color='red')).add_to(m)
+        plugins.Draw(draw_options={'polyline': False, 'circle': False, 'marker': False, 'circlemarker': False},
+                     edit_options={'edit': False}).add_to(m)
+        drawn = st_folium(m, height=450, use_container_width=True, returned_objects=['all_drawings'],
+                          key="selection_map")
+        shapes = [drawn_shape_rows(index, drawing) for drawing in (drawn or {}).get('all_drawings') or []]
+        return np.unique(np.concatenate(shapes)) if shapes else np.empty(0, dtype=np.int64)
+
+    names = df['name'].astype(str)
+    if len(df) > LIST_SELECTION_LIMIT:
+        query = st.text_input("جستجوی نام نمایندگی:", key="selection_query")
+        names = names[names.str.contains(query, regex=False)] if query else names.iloc[:0]
+        if len(names) > LIST_SELECTION_LIMIT:
+            st.caption(f"فقط {LIST_SELECTION_LIMIT} نتیجه اول نمایش داده می‌شود.")
+            names = names.iloc[:LIST_SELECTION_LIMIT]
+    selected = st.multiselect("نمایندگی‌های مورد نظر را انتخاب کنید:", options=names.tolist(),
+                              key="branch_selector")
+    return np.flatnonzero(df['name'].astype(str).isin(selected).to_numpy())
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def get_result_tables(result_key, _results):
+    """جدول مسیر هر نتیجه؛ برای هر result_key یک بار ساخته می‌شود"""
+    return {'route': build_route_table(_results)}
+
+def show_matrices(results):
+    """نمایش پنجره‌ای از ماتریس‌های فاصله و زمان
+
+    فقط همان برش از ماتریس‌های نگاشته در حافظه خوانده و به مرورگر فرستاده می‌شود.
+    """
+    size = len(results['location_names'])
+    row = col = 0
+    if size > MATRIX_WINDOW:
+        st.caption(f"ماتریس‌ها {size}×{size} هستند؛ پنجره‌ای {MATRIX_WINDOW}×{MATRIX_WINDOW} از آن‌ها نمایش داده می‌شود.")
+        col_row, col_col = st.columns(2)
+        row = col_row.number_input("از ردیف:", min_value=1, max_value=size, value=1, key="matrix_row") - 1
+        col = col_col.number_input("از ستون:", min_value=1, max_value=size, value=1, key="matrix_col") - 1
+    names = np.asarray(results['location_names'], dtype=object)
+    rows, cols = slice(row, row + MATRIX_WINDOW), slice(col, col + MATRIX_WINDOW)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("📏 ماتریس فاصله (متر)")
+        st.dataframe(pd.DataFrame(results['distance_matrix'][rows, cols], index=names[rows], columns=names[cols]),
+                     key="distance_matrix_df")
+    with col2:
+        st.subheader("⏱️ ماتریس زمان (ثانیه)")
+        st.dataframe(pd.DataFrame(results['time_matrix'][rows, cols], index=names[rows], columns=names[cols]),
+                     key="time_matrix_df")
+
+@st.cache_resource
+def get_leg_cache():
+    return LegCache()
+
+@st.cache_resource
+def get_matrix_checkpoint():
+    return MatrixCheckpoint()
+
+@st.cache_resource
+def get_matrix_store():
+    """ماتریس‌های نگاشته در حافظه، مشترک بین همه نشست‌ها"""
+    return MatrixStore()
+
+@st.cache_resource
+def get_rate_limiter(api_key, requests_per_second):
+    """سقف درخواست مشترک همه کارها و نشست‌هایی که با یک کلید API کار می‌کنند"""
+    return TokenBucket(requests_per_second)
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
+
+@st.cache_resource
+def get_metrics():
+    """شاخص‌های تجمعی همه اجراها از زمان راه‌اندازی برنامه"""
+    return Metrics()
+
+def show_diagnostics(metrics, registry):
+    """پنل عیب‌یابی: زمان مراحل، درخواست‌های API، کش و روند حل آخرین اجرا"""
+    snapshot = metrics.snapshot()
+    with st.expander("🩺 عیب‌یابی و کارایی"):
+        histograms = [h for h in snapshot['histograms'] if h['name'] == 'nova_phase_seconds']
+        if histograms:
+            st.markdown("##### ⏱️ زمان مراحل")
+            st.dataframe(pd.DataFrame({
+                'مرحله': [h['labels']['phase'] for h in histograms],
+                'تعداد': [h['count'] for h in histograms],
+                'زمان کل (ثانیه)': [round(h['sum'], 3) for h in histograms],
+                'میانگین (ثانیه)': [round(h['sum'] / h['count'], 3) for h in histograms]
+            }), hide_index=True, key="diagnostics_phases")
+
+        latency = [h for h in snapshot['histograms'] if h['name'] == 'nova_api_latency_seconds']
+        if latency:
+            st.markdown("##### 🌐 درخواست‌های API")
+            col1, col2, col3 = st.columns(3)
+            col1.metric("تعداد درخواست", metrics.total('nova_api_requests_total'))
+            col2.metric("تلاش دوباره", metrics.total('nova_api_retries_total'))
+            col3.metric("بلوک ناموفق", metrics.total('nova_matrix_failed_blocks_total'))
+            st.dataframe(pd.DataFrame([
+                {'سرویس': c['labels']['endpoint'], 'کد وضعیت': c['labels']['status'], 'تعداد': c['value']}
+                for c in snapshot['counters'] if c['name'] == 'nova_api_requests_total'
+            ]), hide_index=True, key="diagnostics_api")
+            for h in latency:
+                cumulative = np.array(list(h['buckets'].values()))
+                st.caption(f"توزیع زمان پاسخ {h['labels']['endpoint']} "
+                           f"(میانگین {1000 * h['sum'] / h['count']:.0f} میلی‌ثانیه)")
+                st.bar_chart(pd.Series(np.diff(cumulative, prepend=0), index=[f"≤{b}s" for b in h['buckets']]))
+
+        caches = sorted({c['labels']['cache'] for c in snapshot['counters'] if c['name'] == 'nova_cache_lookups_total'})
+        if caches:
+            st.markdown("##### 💾 کش")
+            hits = [metrics.total('nova_cache_lookups_total', cache=cache, result='hit') for cache in caches]
+            misses = [metrics.total('nova_cache_lookups_total', cache=cache, result='miss') for cache in caches]
+            st.dataframe(pd.DataFrame({
+                'کش': caches,
+                'یافت شد': hits,
+                'یافت نشد': misses,
+                'نرخ موفقیت': [f"{100 * h / (h + m):.0f}%" if h + m else "-" for h, m in zip(hits, misses)]
+            }), hide_index=True, key="diagnostics_cache")
+            cells = [c for c in snapshot['counters'] if c['name'] == 'nova_matrix_cells_total' and c['value']]
+            if cells:
+                st.caption("منشأ خانه‌های ماتریس")
+                st.dataframe(pd.DataFrame({
+                    'منشأ': [c['labels']['source'] for c in cells],
+                    'تعداد خانه': [c['value'] for c in cells]
+                }), hide_index=True, key="diagnostics_cells")
+
+        objective = snapshot['series'].get('nova_solver_objective')
+        if objective:
+            st.markdown("##### 🧮 روند حل")
+            col1, col2 = st.columns(2)
+            col1.metric("جواب‌های یافته‌شده", metrics.total('nova_solver_solutions_total'))
+            col2.metric("شاخه‌های جستجو", metrics.total('nova_solver_branches_total'))
+            points = np.array(objective)
+            st.line_chart(pd.DataFrame({'هزینه': np.minimum.accumulate(points[:, 1])}, index=points[:, 0]))
+
+        col1, col2 = st.columns(2)
+        col1.download_button("دریافت JSON آخرین اجرا", metrics.to_json(), file_name="nova_metrics.json",
+                             mime="application/json", key="diagnostics_json")
+        col2.download_button("دریافت شاخص‌های تجمعی (Prometheus)", registry.to_prometheus(),
+                             file_name="nova_metrics.prom", mime="text/plain", key="diagnostics_prometheus")
+
+@st.fragment(run_every=1.0)
+def show_job_progress(key, label="در حال محاسبه مسیر بهینه..."):
+    """نمایش زنده وضعیت کار پس‌زمینه تا پایان محاسبه"""
+    job = get_job_queue().get(key)
+    if job is None or job.done:
+        st.rerun()
+    count, total = job.progress
+    if job.status == 'queued':
+        st.info("⏳ درخواست در صف محاسبه است...")
+    else:
+        st.progress(count / total if total else 0.0, text=f"{label} {count}/{total}")
+
+def split_values(text):
+    return [value for value in re.split(r'[,،\s]+', text.strip()) if value]
+
+def show_scenarios(results, results_key, branches):
+    """مقایسه سناریوهای زمان توقف، زمان شروع و زیرمجموعه نمایندگی‌ها روی ماتریس همین نتیجه"""
+    with st.expander("🧪 مقایسه سناریوها", expanded=st.session_state.get('sweep_key') is not None):
+        st.caption("همه سناریوها روی ماتریس همین مسیر و بدون درخواست دوباره به API حل می‌شوند؛ "
+                   "هر زیرمجموعه نمایندگی‌ها فقط یک بار حل و بقیه پارامترها روی همان مسیر محاسبه می‌شوند.")
+        col1, col2 = st.columns(2)
+        station_text = col1.text_input("زمان‌های توقف (دقیقه، جدا با ویرگول):",
+                                       value=f"{results['station_time'] // 60}", key="sweep_station_times")
+        start_text = col2.text_input("زمان‌های شروع (جدا با ویرگول):", value=results['start_time_str'],
+                                     key="sweep_start_times")
+        columns = [] if branches is None else [col for col in branches.columns if col not in ('name', 'lat', 'lng')]
+        numeric = [col for col in columns if pd.api.types.is_numeric_dtype(branches[col])]
+        col1, col2 = st.columns(2)
+        group_column = col1.selectbox("تقسیم نمایندگی‌ها بر اساس ستون:", ['-'] + columns, key="sweep_group_column")
+        service_column = col2.selectbox("زمان توقف هر نمایندگی از ستون (دقیقه):", ['-'] + numeric,
+                                        key="sweep_service_column")
+
+        if st.button("▶️ اجرای سناریوها", key="sweep_button"):
+            try:
+                station_times = [float(value) for value in split_values(station_text)]
+                start_times = [datetime.strptime(value, "%H:%M").strftime("%H:%M")
+                               for value in split_values(start_text)]
+            except ValueError:
+                st.error("زمان‌های توقف باید عدد و زمان‌های شروع به شکل HH:MM باشند.")
+                return
+            services = {f"{minutes:g} دقیقه": int(minutes * 60) for minutes in station_times}
+            subsets = {ALL_STOPS: list(range(len(results['locations'])))}
+            if group_column != '-' or service_column != '-':
+                stops = stop_attributes(results['locations'], branches)
+                if group_column != '-':
+                    subsets = group_subsets(stops[group_column])
+                if service_column != '-':
+                    minutes = pd.to_numeric(stops[service_column], errors='coerce')
+                    if minutes.isna().any():
+                        st.info(f"برای {int(minutes.isna().sum())} نمایندگی مقداری در ستون {service_column} نبود؛ "
+                                f"زمان توقف پیش‌فرض برای آن‌ها در نظر گرفته شد.")
+                    minutes = minutes.fillna(results['station_time'] / 60)
+                    services[f"از ستون {service_column}"] = np.concatenate(([0], (minutes * 60).round())).astype(int)
+            if not services or not start_times:
+                st.error("دست‌کم یک زمان توقف و یک زمان شروع لازم است.")
+                return
+
+            key = scenario_key(results_key, subsets, services, start_times)
+            try:
+                get_job_queue().submit(key, run_sweep_job, results['time_matrix'], results['distance_matrix'],
+                                       subsets, services, start_times, {ALL_STOPS: results['route_points']})
+            except QueueFull as e:
+                st.error(str(e))
+                return
+            st.session_state.sweep_key = key
+
+        key = st.session_state.get('sweep_key')
+        job = get_job_queue().get(key) if key else None
+        if job is None:
+            return
+        if not job.done:
+            show_job_progress(key, "در حال حل سناریوها...")
+        elif job.error:
+            st.error(f"خطا در اجرای سناریوها: {job.error}")
+        else:
+            st.dataframe(job.result, use_container_width=True, hide_index=True, key="sweep_table")
+            st.download_button("دریافت جدول مقایسه (CSV)", job.result.to_csv(index=False).encode('utf-8-sig'),
+                               file_name="nova_scenarios.csv", mime="text/csv", key="sweep_download")
 
 def main():
     st.title("🚚 سیستم مسیریابی هوشمند")
     
     if 'results' not in st.session_state:
         st.session_state.results = None
-    if 'map_data' not in st.session_state:
-        st.session_state.map_data = None
+        st.session_state.results_key = None
+    if 'matrix_store' not in st.session_state:
+        st.session_state.matrix_store = None
+    if 'leg_store' not in st.session_state:
+        st.session_state.leg_store = {}
+    if 'diagnostics' not in st.session_state:
+        st.session_state.diagnostics = Metrics()
+    if 'job_key' not in st.session_state:
+        st.session_state.job_key = None
+        st.session_state.job_applied = True
     
     api_key = st.text_input("کلید API نشان:", value="api key", type="password", key="api_key")
     
     if not api_key:
         st.warning("لطفاً کلید API نشان را وارد کنید")
         return
-        
-    optimizer = RouteOptimizer(api_key)
     
     col_left, col_right = st.columns([1, 2])
     
@@ -288,13 +445,42 @@ def main():
                                      min_value=1, value=15, key="station_time") * 60
         start_time = st.time_input("زمان شروع:", value=datetime.strptime("08:00", "%H:%M"), key="start_time")
         start_time_str = start_time.strftime("%H:%M")
+        requests_per_second = st.number_input("سقف درخواست به API در ثانیه:",
+                                              min_value=0.1, value=2.0, step=0.5, key="requests_per_second")
+        max_workers = st.number_input("تعداد درخواست‌های همزمان:",
+                                      min_value=1, max_value=32, value=8, key="max_workers")
+        matrix_backends = {'ماتریس فاصله یکجا': 'matrix', 'مسیر به مسیر': 'direction'}
+        matrix_backend = st.selectbox("روش محاسبه ماتریس:", options=list(matrix_backends), key="matrix_backend")
+        sparse_mode = st.checkbox("حالت تُنُک برای تعداد نقاط زیاد", key="sparse_mode",
+                                  help="فقط مسیر تا نزدیک‌ترین همسایه‌ها از API دریافت و بقیه برآورد می‌شود")
+        sparse_k = st.number_input("تعداد نزدیک‌ترین همسایه‌ها:", min_value=1, value=10,
+                                   key="sparse_k", disabled=not sparse_mode)
+        decompose_mode = st.checkbox("تجزیه جغرافیایی برای هزاران نقطه", key="decompose_mode",
+                                     help="نقاط خوشه‌بندی، خوشه‌ها به صورت موازی حل و مسیرها در مرز خوشه‌ها بهبود داده می‌شوند")
+        cluster_size = st.number_input("حداکثر نقاط هر خوشه:", min_value=10, value=150,
+                                       key="cluster_size", disabled=not decompose_mode)
+        map_modes = {'خودکار': 'auto', 'کامل (همه جزئیات)': 'detailed', 'سبک (برای مسیرهای بزرگ)': 'large'}
+        map_mode = st.selectbox("نمایش نقشه:", options=list(map_modes), key="map_mode",
+                                help="در حالت سبک ایستگاه‌ها خوشه‌بندی و مسیرها ساده و در چند لایه رسم می‌شوند")
+        portfolio_mode = st.checkbox("حل موازی با چند راهبرد", key="portfolio_mode",
+                                     help="چند ترکیب راهبرد شروع و فراابتکاری به صورت همزمان روی هسته‌های پردازنده اجرا و بهترین مسیر انتخاب می‌شود")
+
+    planner_options = {
+        'cache': get_leg_cache(),
+        'checkpoint': get_matrix_checkpoint(),
+        'matrix_store': get_matrix_store(),
+        'rate_limiter': get_rate_limiter(api_key, requests_per_second),
+        'max_workers': int(max_workers),
+        'matrix_backend': matrix_backends[matrix_backend]
+    }
+    optimizer = RouteOptimizer(api_key, leg_store=st.session_state.leg_store, **planner_options)
 
     with col_right:
         st.subheader("📍 اطلاعات نقاط")
         
         uploaded_file = st.file_uploader(
-            "فایل اکسل نمایندگی‌ها را آپلود کنید",
-            type=['xlsx'],
+            "فایل نمایندگی‌ها (اکسل، CSV یا Parquet) را آپلود کنید",
+            type=[suffix.lstrip('.') for suffix in INPUT_SUFFIXES],
             key="excel_uploader"
         )
         
@@ -323,43 +509,49 @@ def main():
             locations.append((start_lat, start_lng))
             location_names.append(start_name)
         
+        branches = None
         if uploaded_file is not None:
             try:
-                df = pd.read_excel(uploaded_file)
-                
-                required_columns = ['name', 'lat', 'lng']
-                if not all(col in df.columns for col in required_columns):
-                    st.error("فایل اکسل باید شامل ستون‌های 'name'، 'lat' و 'lng' باشد.")
-                    return
+                with optimizer.metrics.phase('read'):
+                    df, ingest_report = load_branch_file(uploaded_file_hash(uploaded_file), uploaded_file.name,
+                                                         uploaded_file.getvalue())
+                branches = df
+                if ingest_report['invalid'] or ingest_report['duplicates']:
+                    st.info(f"از {ingest_report['rows']} سطر فایل، {ingest_report['invalid']} سطر بدون نام یا مختصات "
+                            f"معتبر و {ingest_report['duplicates']} سطر با مختصات تکراری کنار گذاشته شد.")
                 
                 st.subheader("📋 لیست نمایندگی‌های موجود")
-                st.dataframe(df, key="branches_df")
+                if len(df) > LIST_SELECTION_LIMIT:
+                    st.caption(f"تعداد {len(df)} نمایندگی بارگذاری شد؛ فقط نمایندگی‌های انتخاب‌شده نمایش داده می‌شوند.")
+                else:
+                    st.dataframe(df, key="branches_df")
                 
                 st.subheader("🔍 انتخاب نمایندگی‌ها")
-                selected_branches = st.multiselect(
-                    "نمایندگی‌های مورد نظر را انتخاب کنید:",
-                    options=df['name'].tolist(),
-                    key="branch_selector"
-                )
+                index = get_branch_index(uploaded_file_hash(uploaded_file), df)
+                with optimizer.metrics.phase('selection'):
+                    selected_rows = select_branches(df, index, (start_lat, start_lng))
                 
-                if selected_branches:
-                    selected_df = df[df['name'].isin(selected_branches)]
-                    for _, row in selected_df.iterrows():
-                        locations.append((float(row['lat']), float(row['lng'])))
-                        location_names.append(str(row['name']))
+                if len(selected_rows):
+                    selected_df = df.iloc[selected_rows]
+                    locations.extend(zip(selected_df['lat'].astype(float).tolist(),
+                                         selected_df['lng'].astype(float).tolist()))
+                    location_names.extend(selected_df['name'].astype(str).tolist())
                     
-                    st.success(f"تعداد {len(selected_branches)} نمایندگی انتخاب شد.")
+                    st.success(f"تعداد {len(selected_rows)} نمایندگی انتخاب شد.")
                     
                     st.subheader("📍 نمایندگی‌های انتخاب شده")
                     selected_info = pd.DataFrame({
-                        'نام نمایندگی': selected_branches,
+                        'نام نمایندگی': selected_df['name'].values,
                         'عرض جغرافیایی': selected_df['lat'].values,
                         'طول جغرافیایی': selected_df['lng'].values
                     })
                     st.dataframe(selected_info, key="selected_branches_df")
                 
+            except LocationFileError as e:
+                st.error(str(e))
+                return
             except Exception as e:
-                st.error(f"خطا در خواندن فایل اکسل: {str(e)}")
+                st.error(f"خطا در خواندن فایل: {str(e)}")
                 return
 
     if st.button("🔍 محاسبه مسیر بهینه", key="calculate_button"):
@@ -367,102 +559,65 @@ def main():
             st.error("حداقل دو نقطه باید وارد شود")
             return
             
-        with st.spinner('در حال محاسبه مسیر بهینه...'):
-            distance_matrix, time_matrix = optimizer.create_distance_time_matrices(locations)
-            
-            if distance_matrix is None or time_matrix is None:
-                st.error("خطا در محاسبه ماتریس‌های فاصله و زمان")
-                return
-
-            manager = pywrapcp.RoutingIndexManager(len(locations), 1, 0)
-            routing = pywrapcp.RoutingModel(manager)
-
-            def time_callback(from_index, to_index):
-                from_node = manager.IndexToNode(from_index)
-                to_node = manager.IndexToNode(to_index)
-                return time_matrix[from_node][to_node]
-
-            transit_callback_index = routing.RegisterTransitCallback(time_callback)
-            routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-            routing.AddDimension(
-                transit_callback_index,
-                0,
-                24 * 3600,
-                True,
-                'Time'
+        plan_options = {
+            'sparse_k': int(sparse_k) if sparse_mode else None,
+            'portfolio': portfolio_mode,
+            'decompose': decompose_mode,
+            'cluster_size': int(cluster_size)
+        }
+        key = instance_key(locations, location_names, station_time, start_time_str,
+                           dict(plan_options, matrix_backend=planner_options['matrix_backend']))
+        try:
+            get_job_queue().submit(
+                key, run_plan_job, api_key, planner_options, list(locations), list(location_names),
+                station_time, start_time_str,
+                dict(plan_options, previous_matrix=st.session_state.matrix_store,
+                     previous_result=st.session_state.results),
+                get_metrics()
             )
+        except QueueFull as e:
+            st.error(str(e))
+            return
+        st.session_state.job_key = key
+        st.session_state.job_applied = False
 
-            search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-            search_parameters.first_solution_strategy = (
-                routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-            search_parameters.local_search_metaheuristic = (
-                routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
-            search_parameters.time_limit.seconds = 30
-
-            solution = routing.SolveWithParameters(search_parameters)
-
-            if solution:
-                route_points = []
-                index = routing.Start(0)
-                while not routing.IsEnd(index):
-                    route_points.append(manager.IndexToNode(index))
-                    index = solution.Value(routing.NextVar(index))
-                route_points.append(manager.IndexToNode(index))
-
-                total_time = 0
-                total_distance = 0
-                for i in range(len(route_points)-1):
-                    from_node = route_points[i]
-                    to_node = route_points[i+1]
-                    total_time += time_matrix[from_node][to_node]
-                    total_distance += distance_matrix[from_node][to_node]
-                    if i > 0:
-                        total_time += station_time
-
-                st.session_state.results = {
-                    'route_points': route_points,
-                    'total_time': total_time,
-                    'total_distance': total_distance,
-                    'distance_matrix': distance_matrix,
-                    'time_matrix': time_matrix,
-                    'location_names': location_names,
-                    'start_time_str': start_time_str,
-                    'station_time': station_time
-                }
-
-                m, arrival_times = optimizer.create_route_map(
-                    locations, route_points, location_names,
-                    time_matrix, station_time, start_time_str
-                )
-                st.session_state.map_data = {
-                    'm': m,
-                    'arrival_times': arrival_times
-                }
+    job = get_job_queue().get(st.session_state.job_key) if st.session_state.job_key else None
+    if job is not None and not st.session_state.job_applied:
+        if not job.done:
+            show_job_progress(job.key)
+            return
+
+        st.session_state.job_applied = True
+        for level, message in job.messages:
+            getattr(st, level)(message)
+        if job.error:
+            st.error(f"خطا در محاسبه مسیر: {job.error}")
+            return
+        if job.result['last_matrix'] is not None:
+            st.session_state.matrix_store = job.result['last_matrix']
+        results = job.result['results']
+        optimizer.leg_store.update(job.result['legs'])
+        optimizer.prune_leg_store(results['locations'])
+        st.session_state.results = results
+        st.session_state.results_key = job.key
+        with optimizer.metrics.phase('map'):
+            optimizer.route_map_html(results, map_modes[map_mode])
+        get_metrics().merge(optimizer.metrics)
+        diagnostics = Metrics()
+        diagnostics.merge(job.result['metrics'])
+        diagnostics.merge(optimizer.metrics)
+        st.session_state.diagnostics = diagnostics
 
     if st.session_state.results is not None:
         results = st.session_state.results
         
         st.success("✅ مسیر بهینه محاسبه شد!")
         
-        col1, col2 = st.columns(2)
-        with col1:
-            st.subheader("📏 ماتریس فاصله (متر)")
-            df_distance = pd.DataFrame(
-                results['distance_matrix'],
-                index=results['location_names'],
-                columns=results['location_names']
-            )
-            st.dataframe(df_distance, key="distance_matrix_df")
+        with st.session_state.diagnostics.phase('table'):
+            tables = get_result_tables(st.session_state.results_key, results)
         
-        with col2:
-            st.subheader("⏱️ ماتریس زمان (ثانیه)")
-            df_time = pd.DataFrame(
-                results['time_matrix'],
-                index=results['location_names'],
-                columns=results['location_names']
-            )
-            st.dataframe(df_time, key="time_matrix_df")
+        if results['distance_matrix'] is not None:
+            show_matrices(results)
 
         end_time = datetime.strptime(results['start_time_str'], "%H:%M") + timedelta(seconds=int(results['total_time']))
         st.markdown(f"""
@@ -497,47 +652,18 @@ def main():
         </div>
         """, unsafe_allow_html=True)
 
-        if st.session_state.map_data is not None:
-            st.subheader("🗺️ نقشه مسیر")
-            st_folium(st.session_state.map_data['m'], width=1000, height=600)
+        st.subheader("🗺️ نقشه مسیر")
+        map_html = optimizer.route_map_html(results, map_modes[map_mode])
+        if map_html is not None:
+            components.html(map_html, height=600)
 
-            st.subheader("📋 جدول مسیر")
-            route_data = []
-            current_time = datetime.strptime(results['start_time_str'], "%H:%M")
-            
-            time_matrix = results['time_matrix']
-            distance_matrix = results['distance_matrix']
-            
-            for i, point_idx in enumerate(results['route_points']):
-                next_travel_time = 0
-                if i < len(results['route_points']) - 1:
-                    next_point_idx = results['route_points'][i + 1]
-                    next_travel_time = int(time_matrix[point_idx][next_point_idx])  # تبدیل به int
+        st.subheader("📋 جدول مسیر")
+        st.dataframe(tables['route'], use_container_width=True, key="route_table")
 
-                station_type = 'نقطه شروع' if i == 0 else ('نقطه پایان' if i == len(results['route_points'])-1 else 'نمایندگی')
-                
-                departure_time = current_time
-                if i > 0 and i < len(results['route_points']) - 1:  # برای همه ایستگاه‌ها به جز نقطه شروع و پایان
-                    departure_time = current_time + timedelta(seconds=int(results['station_time']))
-
-                route_data.append({
-                    'ردیف': i + 1,
-                    'نام مکان': results['location_names'][point_idx],
-                    'نوع': station_type,
-                    'زمان رسیدن': current_time.strftime("%H:%M"),
-                    'مدت توقف': f"{int(results['station_time'])//60} دقیقه" if i > 0 and i < len(results['route_points'])-1 else "-",
-                    'زمان حرکت': departure_time.strftime("%H:%M") if i < len(results['route_points'])-1 else "-",
-                    'زمان سفر تا ایستگاه بعدی': f"{next_travel_time//60:.0f} دقیقه" if next_travel_time > 0 else "-",
-                    'مسافت تا ایستگاه بعدی': f"{float(distance_matrix[point_idx][results['route_points'][i+1]])/1000:.1f} کیلومتر" if i < len(results['route_points'])-1 else "-"
-                })
-                
-                if i < len(results['route_points']) - 1:
-                    if i > 0:  
-                        current_time += timedelta(seconds=int(results['station_time']))
-                    current_time += timedelta(seconds=int(next_travel_time))
-            
-            route_df = pd.DataFrame(route_data)
-            st.dataframe(route_df, use_container_width=True, key="route_table")
+        if results['time_matrix'] is not None:
+            show_scenarios(results, st.session_state.results_key, branches)
+
+    show_diagnostics(st.session_state.diagnostics, get_metrics())
 
 if __name__ == "__main__":
     main()
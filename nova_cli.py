@@ -0,0 +1,157 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from ingest import INPUT_SUFFIXES, read_locations
+from leg_cache import LegCache, MatrixCheckpoint, MatrixStore
+from metrics import Metrics
+from neshan import DIRECTION_URL, DISTANCE_MATRIX_URL
+from planner import RoutePlanner, build_route_table, plan_route
+
+
+def output_stem(path):
+    """پیشوند فایل‌های خروجی هر ورودی؛ پسوند در آن می‌آید تا depot.csv و depot.xlsx خروجی هم را بازنویسی نکنند"""
+    stem, suffix = os.path.splitext(os.path.basename(path))
+    return f"{stem}_{suffix.lstrip('.').lower()}"
+
+
+def optimize_file(path, output_dir, options):
+    """بهینه‌سازی مسیر یک فایل و نوشتن جدول زمان‌بندی و شاخص‌ها؛ خروجی شاخص‌ها"""
+    started = time.perf_counter()
+    diagnostics = Metrics()
+    with diagnostics.phase('read'):
+        df, ingest_report = read_locations(path)
+
+    locations = [(options['start_lat'], options['start_lng'])]
+    location_names = [options['start_name']]
+    locations += list(zip(df['lat'].astype(float), df['lng'].astype(float)))
+    location_names += df['name'].astype(str).tolist()
+
+    planner = RoutePlanner(
+        options['api_key'],
+        cache=LegCache(),
+        checkpoint=MatrixCheckpoint(),
+        matrix_store=MatrixStore(),
+        requests_per_second=options['requests_per_second'],
+        max_workers=options['max_workers'],
+        matrix_backend=options['matrix_backend'],
+        direction_url=options['direction_url'],
+        distance_matrix_url=options['distance_matrix_url'],
+        metrics=diagnostics
+    )
+    results = plan_route(
+        planner, locations, location_names, options['station_time'], options['start_time'],
+        sparse_k=options['sparse_k'],
+        portfolio=options['portfolio'],
+        decompose=options['decompose'],
+        cluster_size=options['cluster_size']
+    )
+
+    stem = output_stem(path)
+    metrics = {'file': path, 'stops': len(locations) - 1, 'ingest': ingest_report}
+    if results is None:
+        metrics['error'] = "مسیر بهینه محاسبه نشد"
+    else:
+        with diagnostics.phase('table'):
+            build_route_table(results).to_csv(
+                os.path.join(output_dir, f"{stem}_schedule.csv"), index=False, encoding='utf-8-sig')
+        end_time = datetime.strptime(options['start_time'], "%H:%M") + timedelta(seconds=results['total_time'])
+        metrics.update({
+            'total_time': results['total_time'],
+            'total_distance': results['total_distance'],
+            'end_time': end_time.strftime("%H:%M")
+        })
+    metrics['elapsed'] = round(time.perf_counter() - started, 3)
+    metrics['diagnostics'] = diagnostics.snapshot()
+
+    with open(os.path.join(output_dir, f"{stem}_metrics.json"), 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2)
+    return metrics
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="بهینه‌سازی دسته‌ای مسیر برای همه فایل‌های نمایندگی یک پوشه بدون رابط کاربری")
+    parser.add_argument('input_dir', help="پوشه فایل‌های اکسل، CSV یا Parquet با ستون‌های name، lat و lng")
+    parser.add_argument('-o', '--output-dir', default='nova_output', help="پوشه خروجی")
+    parser.add_argument('--api-key', default=os.environ.get('NESHAN_API_KEY'),
+                        help="کلید API نشان (پیش‌فرض: متغیر محیطی NESHAN_API_KEY)")
+    parser.add_argument('--start-name', default="دفتر مرکزی")
+    parser.add_argument('--start-lat', type=float, default=35.6997)
+    parser.add_argument('--start-lng', type=float, default=51.3380)
+    parser.add_argument('--station-time', type=int, default=15, help="زمان توقف در هر ایستگاه (دقیقه)")
+    parser.add_argument('--start-time', default="08:00", help="زمان شروع (HH:MM)")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="تعداد فایل‌های همزمان")
+    parser.add_argument('--requests-per-second', type=float, default=2.0,
+                        help="سقف کل درخواست به API در ثانیه (بین فایل‌های همزمان تقسیم می‌شود)")
+    parser.add_argument('--max-workers', type=int, default=8, help="درخواست‌های همزمان هر فایل")
+    parser.add_argument('--matrix-backend', choices=['matrix', 'direction'], default='matrix')
+    parser.add_argument('--direction-url', default=DIRECTION_URL)
+    parser.add_argument('--distance-matrix-url', default=DISTANCE_MATRIX_URL)
+    parser.add_argument('--sparse-k', type=int, default=None, help="فعال‌سازی حالت تُنُک با k همسایه")
+    parser.add_argument('--portfolio', action='store_true', help="حل موازی با چند راهبرد")
+    parser.add_argument('--decompose', action='store_true', help="تجزیه جغرافیایی برای هزاران نقطه")
+    parser.add_argument('--cluster-size', type=int, default=150)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.api_key:
+        logging.error("کلید API نشان مشخص نشده است (--api-key یا NESHAN_API_KEY)")
+        return 2
+
+    files = sorted(
+        os.path.join(args.input_dir, name) for name in os.listdir(args.input_dir)
+        if name.lower().endswith(INPUT_SUFFIXES) and not name.startswith('~$')
+    )
+    if not files:
+        logging.error(f"هیچ فایل اکسل، CSV یا Parquet در {args.input_dir} یافت نشد")
+        return 1
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = max(1, min(args.jobs, len(files)))
+    options = {
+        'api_key': args.api_key,
+        'start_name': args.start_name,
+        'start_lat': args.start_lat,
+        'start_lng': args.start_lng,
+        'station_time': args.station_time * 60,
+        'start_time': args.start_time,
+        'requests_per_second': args.requests_per_second / jobs,
+        'max_workers': args.max_workers,
+        'matrix_backend': args.matrix_backend,
+        'direction_url': args.direction_url,
+        'distance_matrix_url': args.distance_matrix_url,
+        'sparse_k': args.sparse_k,
+        'portfolio': args.portfolio,
+        'decompose': args.decompose,
+        'cluster_size': args.cluster_size
+    }
+
+    summary = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(optimize_file, path, args.output_dir, options): path for path in files}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                metrics = future.result()
+            except Exception as e:
+                metrics = {'file': path, 'error': str(e)}
+            metrics.pop('diagnostics', None)
+            logging.info(json.dumps(metrics, ensure_ascii=False))
+            summary.append(metrics)
+
+    with open(os.path.join(args.output_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(sorted(summary, key=lambda item: item['file']), f, ensure_ascii=False, indent=2)
+    return 1 if any('error' in metrics for metrics in summary) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
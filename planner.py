@@ -0,0 +1,444 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from decomposition import solve_decomposed
+from geo import (calibrate_estimates, decode_polyline, encode_polyline, haversine_matrix,
+                 nearest_neighbors_mask)
+from metrics import Metrics
+from neshan import (DIRECTION_URL, DISTANCE_MATRIX_URL, DirectionMatrixProvider, DistanceMatrixProvider,
+                    NeshanAuthError, NeshanError, TokenBucket, call_with_retry, check_response,
+                    create_session)
+from solver import adaptive_time_limit, build_schedule, schedule_from_legs, solve_portfolio, solve_route
+
+logger = logging.getLogger(__name__)
+
+
+class RoutePlanner:
+    """ساخت ماتریس و ارتباط با API نشان بدون وابستگی به رابط کاربری
+
+    زیرکلاس‌ها با بازنویسی notify و متدهای progress_* پیام‌ها و پیشرفت
+    کار را نمایش می‌دهند. شاخص‌های کارایی در self.metrics ثبت می‌شوند.
+    """
+
+    def __init__(self, api_key, cache=None, vehicle_type='car', requests_per_second=2.0, max_workers=8,
+                 matrix_backend='matrix', matrix_provider=None, direction_url=DIRECTION_URL,
+                 distance_matrix_url=DISTANCE_MATRIX_URL, leg_store=None, checkpoint=None,
+                 metrics=None, matrix_store=None, rate_limiter=None):
+        self.api_key = api_key
+        self.cache = cache
+        self.vehicle_type = vehicle_type
+        self.max_workers = max_workers
+        self.metrics = metrics if metrics is not None else Metrics()
+        # با دادن rate_limiter چند مسیریاب همزمان یک سقف درخواست مشترک دارند
+        self.rate_limiter = rate_limiter if rate_limiter is not None else TokenBucket(requests_per_second)
+        self.session = create_session(api_key, pool_size=max_workers, metrics=self.metrics)
+        self.timeout = 30
+        self.direction_url = direction_url
+        self.estimate_penalty = 1.2
+        self.retries = 4
+        self.backoff_base = 0.5
+        self.backoff_max = 30.0
+        self.checkpoint = checkpoint
+        self.matrix_store = matrix_store
+        self.estimated = None
+        self.last_matrix = None
+        self.leg_store = leg_store if leg_store is not None else {}
+
+        if matrix_provider is None:
+            if matrix_backend == 'direction':
+                matrix_provider = DirectionMatrixProvider(self.fetch_leg)
+            else:
+                matrix_provider = DistanceMatrixProvider(
+                    self.session, self.rate_limiter, cache=cache, vehicle_type=vehicle_type,
+                    url=distance_matrix_url, timeout=self.timeout)
+        self.matrix_provider = matrix_provider
+
+    def notify(self, level, message):
+        """گزارش پیام (info، warning یا error)"""
+        getattr(logger, level)(message)
+
+    def progress_start(self, total):
+        pass
+
+    def progress_update(self, count, total):
+        pass
+
+    def progress_end(self):
+        pass
+
+    def fetch_leg(self, start_coords, end_coords):
+        """دریافت یک مسیر از کش یا API نشان؛ در صورت خطا NeshanError می‌دهد"""
+        if self.cache is not None:
+            cached = self.cache.get(start_coords, end_coords, self.vehicle_type, require_geometry=True)
+            self.metrics.count('nova_cache_lookups_total', cache='legs',
+                               result='miss' if cached is None else 'hit')
+            if cached is not None:
+                self.remember_leg(start_coords, end_coords, *cached[:3])
+                return cached
+
+        origin = f"{start_coords[0]},{start_coords[1]}"
+        destination = f"{end_coords[0]},{end_coords[1]}"
+        
+        params = {
+            'type': self.vehicle_type,
+            'origin': origin,
+            'destination': destination
+        }
+        
+        self.rate_limiter.acquire()
+        response = self.session.get(self.direction_url, params=params, timeout=self.timeout)
+        check_response(response, "API مسیریابی")
+        data = response.json()
+        if 'routes' in data and data['routes']:
+            route = data['routes'][0]
+            if 'legs' in route and route['legs']:
+                leg = route['legs'][0]
+                distance = leg['distance']['value']
+                duration = leg['duration']['value']
+                
+                route_coords = []
+                for step in leg['steps']:
+                    if 'start_location' in step:
+                        route_coords.append([
+                            step['start_location'][1],
+                            step['start_location'][0]
+                        ])
+                
+                if leg['steps'] and 'end_location' in leg['steps'][-1]:
+                    route_coords.append([
+                        leg['steps'][-1]['end_location'][1],
+                        leg['steps'][-1]['end_location'][0]
+                    ])
+                
+                if self.cache is not None:
+                    self.cache.put(start_coords, end_coords, self.vehicle_type,
+                                   route_coords, distance, duration, leg['steps'])
+                self.remember_leg(start_coords, end_coords, route_coords, distance, duration)
+                return route_coords, distance, duration, leg['steps']
+        
+        raise NeshanError(f"خطا در دریافت مسیر از {origin} به {destination}")
+
+    def remember_leg(self, start_coords, end_coords, route_coords, distance, duration):
+        """نگهداری فشرده هندسه، فاصله و زمان یک مسیر برای استفاده در نقشه"""
+        self.leg_store[(tuple(start_coords), tuple(end_coords))] = (
+            encode_polyline(route_coords),
+            int(distance),
+            int(duration)
+        )
+
+    def stored_leg(self, start_coords, end_coords):
+        """خواندن مسیر ذخیره‌شده (در صورت نبود، مسیر رفت به صورت وارونه)"""
+        leg = self.leg_store.get((tuple(start_coords), tuple(end_coords)))
+        reverse = False
+        if leg is None:
+            leg = self.leg_store.get((tuple(end_coords), tuple(start_coords)))
+            reverse = True
+        if leg is None:
+            return None
+        route_coords = decode_polyline(leg[0])
+        if reverse:
+            route_coords.reverse()
+        return route_coords, leg[1], leg[2]
+
+    def prune_leg_store(self, locations):
+        """حذف مسیرهای ذخیره‌شده نقاطی که دیگر انتخاب نشده‌اند"""
+        current = set(locations)
+        for key in [key for key in self.leg_store if key[0] not in current or key[1] not in current]:
+            del self.leg_store[key]
+
+    def prefetch_route_legs(self, locations, route_points):
+        """دریافت همزمان هندسه یال‌های مسیر نهایی که هنوز ذخیره نشده‌اند"""
+        pairs = [
+            (locations[a], locations[b]) for a, b in zip(route_points[:-1], route_points[1:])
+            if self.stored_leg(locations[a], locations[b]) is None
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.fetch_leg_with_retry, start, end) for start, end in pairs]
+        for future in futures:
+            if future.exception() is not None:
+                self.notify('warning', str(future.exception()))
+
+    def fetch_leg_with_retry(self, start_coords, end_coords):
+        """دریافت یک مسیر با تلاش دوباره برای خطاهای گذرا"""
+        return call_with_retry(self.fetch_leg, start_coords, end_coords, retries=self.retries,
+                               base_delay=self.backoff_base, max_delay=self.backoff_max, metrics=self.metrics)
+
+    def get_route_neshan(self, start_coords, end_coords):
+        """دریافت مسیر از API نشان (با خواندن از کش در صورت وجود)"""
+        try:
+            return self.fetch_leg_with_retry(start_coords, end_coords)
+        except NeshanError as e:
+            self.notify('warning', str(e))
+            return None, None, None, None
+        except Exception as e:
+            self.notify('error', f"خطا در ارتباط با API نشان: {str(e)}")
+            return None, None, None, None
+
+    def create_distance_time_matrices(self, locations, sparse_k=None, previous=None, store=True):
+        """ایجاد ماتریس‌های فاصله و زمان با درخواست‌های همزمان
+
+        در حالت تُنُک (sparse_k) فقط مسیر هر نقطه تا k نزدیک‌ترین همسایه‌اش
+        از API دریافت می‌شود و بقیه با برآورد کالیبره‌شده پر می‌شوند.
+        با دادن ماتریس قبلی (previous) فقط سطر و ستون نقاط جدید محاسبه می‌شود.
+        درخواست‌های ناموفق با عقب‌نشینی نمایی دوباره فرستاده می‌شوند و یال‌هایی
+        که باز هم دریافت نشوند برآورد می‌شوند. پیشرفت کار در checkpoint ذخیره
+        می‌شود تا ساخت قطع‌شده از همان‌جا ادامه یابد.
+        با store و matrix_store، ماتریس‌های همین مجموعه نقاط از فایل مشترک
+        خوانده و نتیجه به صورت int32 نگاشته در حافظه برگردانده می‌شود.
+        """
+        size = len(locations)
+        distance_matrix = np.zeros((size, size), dtype=np.float32)
+        time_matrix = np.zeros((size, size), dtype=np.float32)
+        provider = self.matrix_provider
+        
+        stored = None
+        if store and self.matrix_store is not None:
+            stored = self.matrix_store.load(locations, self.vehicle_type)
+            if stored is not None:
+                previous = stored
+        
+        known = np.eye(size, dtype=bool)
+        if previous is not None and previous.get('vehicle_type') == self.vehicle_type:
+            old_index = {loc: k for k, loc in enumerate(previous['locations'])}
+            reused = [(i, old_index[loc]) for i, loc in enumerate(locations) if loc in old_index]
+            if reused:
+                new_idx, old_idx = (list(idx) for idx in zip(*reused))
+                target, source = np.ix_(new_idx, new_idx), np.ix_(old_idx, old_idx)
+                distance_matrix[target] = previous['distance_matrix'][source]
+                time_matrix[target] = previous['time_matrix'][source]
+                known[target] = previous['known'][source]
+                np.fill_diagonal(known, True)
+        self.metrics.count('nova_matrix_cells_total', int(known.sum()) - size, source='previous')
+        
+        if self.checkpoint is not None:
+            saved = self.checkpoint.load(locations, self.vehicle_type)
+            if saved is not None:
+                restored = saved['known'] & ~known
+                distance_matrix[restored] = saved['distance_matrix'][restored]
+                time_matrix[restored] = saved['time_matrix'][restored]
+                known |= restored
+                self.metrics.count('nova_matrix_cells_total', int(restored.sum()), source='checkpoint')
+        
+        if self.cache is not None and not known.all():
+            seeded = int(known.sum())
+            rows, cols, distances, durations = self.cache.get_legs(locations, self.vehicle_type)
+            hit = ~known[rows, cols]
+            rows, cols = rows[hit], cols[hit]
+            distance_matrix[rows, cols] = distances[hit]
+            time_matrix[rows, cols] = durations[hit]
+            known[rows, cols] = True
+            self.metrics.count('nova_cache_lookups_total', len(rows), cache='legs', result='hit')
+            self.metrics.count('nova_cache_lookups_total', size * size - seeded - len(rows),
+                               cache='legs', result='miss')
+            if provider.symmetric:
+                mirror = known.T & ~known
+                distance_matrix[mirror] = distance_matrix.T[mirror]
+                time_matrix[mirror] = time_matrix.T[mirror]
+                known |= mirror
+            self.metrics.count('nova_matrix_cells_total', int(known.sum()) - seeded, source='cache')
+        
+        straight = haversine_matrix(locations)
+        wanted = ~known
+        if sparse_k:
+            wanted &= nearest_neighbors_mask(straight, sparse_k)
+        blocks = provider.blocks(wanted)
+        
+        total = len(blocks)
+        count = 0
+        failed = 0
+        completed = False
+        self.progress_start(total)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {
+                    executor.submit(call_with_retry, provider.fetch_block,
+                                    [locations[i] for i in rows],
+                                    [locations[j] for j in cols],
+                                    retries=self.retries, base_delay=self.backoff_base,
+                                    max_delay=self.backoff_max, metrics=self.metrics): (rows, cols)
+                    for rows, cols in blocks
+                }
+                for future in as_completed(futures):
+                    rows, cols = futures[future]
+                    count += 1
+                    self.progress_update(count, total)
+                    
+                    try:
+                        distances, durations = future.result()
+                    except NeshanAuthError as e:
+                        for pending in futures:
+                            pending.cancel()
+                        self.notify('error', f"دسترسی به API نشان ممکن نیست: {str(e)}")
+                        return None, None
+                    except Exception as e:
+                        failed += 1
+                        self.metrics.count('nova_matrix_failed_blocks_total')
+                        logger.warning(f"دریافت فاصله بین نقاط {rows[0]+1} و {cols[0]+1} ناموفق بود: {str(e)}")
+                        continue
+                    
+                    fetched = ~(np.isnan(distances) | np.isnan(durations))
+                    seeded = int(known.sum())
+                    block = np.ix_(rows, cols)
+                    distance_matrix[block] = np.where(fetched, distances, distance_matrix[block])
+                    time_matrix[block] = np.where(fetched, durations, time_matrix[block])
+                    known[block] |= fetched
+                    if provider.symmetric:
+                        block = np.ix_(cols, rows)
+                        distance_matrix[block] = np.where(fetched.T, distances.T, distance_matrix[block])
+                        time_matrix[block] = np.where(fetched.T, durations.T, time_matrix[block])
+                        known[block] |= fetched.T
+                    self.metrics.count('nova_matrix_cells_total', int(known.sum()) - seeded, source='api')
+                    if self.checkpoint is not None:
+                        self.checkpoint.save(locations, self.vehicle_type, distance_matrix, time_matrix, known)
+            
+            if total and failed == total:
+                self.notify('error', "هیچ‌یک از درخواست‌های API نشان موفق نبود")
+                return None, None
+            if failed:
+                self.notify('warning', f"{failed} درخواست پس از چند بار تلاش ناموفق ماند؛ "
+                                       f"مسیرهای آن برآورد شد.")
+            
+            self.estimated = ~known
+            self.metrics.count('nova_matrix_cells_total', int(self.estimated.sum()), source='estimate')
+            if self.estimated.any():
+                detour, seconds_per_meter = calibrate_estimates(
+                    distance_matrix, time_matrix, straight, known)
+                estimate = straight * detour * self.estimate_penalty
+                distance_matrix[self.estimated] = estimate[self.estimated]
+                time_matrix[self.estimated] = estimate[self.estimated] * seconds_per_meter
+            
+            if stored is not None and np.array_equal(known, stored['known']):
+                # همه خانه‌ها از ماتریس ذخیره‌شده آمده‌اند و نوشتن دوباره لازم نیست
+                self.last_matrix = stored
+            else:
+                self.last_matrix = {
+                    'locations': list(locations),
+                    'vehicle_type': self.vehicle_type,
+                    'distance_matrix': distance_matrix.astype(np.int32),
+                    'time_matrix': time_matrix.astype(np.int32),
+                    'known': known
+                }
+                if store and self.matrix_store is not None:
+                    self.last_matrix = self.matrix_store.save(
+                        locations, self.vehicle_type, self.last_matrix['distance_matrix'],
+                        self.last_matrix['time_matrix'], known) or self.last_matrix
+            
+            self.progress_end()
+            completed = True
+            return self.last_matrix['distance_matrix'], self.last_matrix['time_matrix']
+        
+        except Exception as e:
+            self.notify('error', f"خطا در ایجاد ماتریس‌ها: {str(e)}")
+            return None, None
+        
+        finally:
+            if self.checkpoint is not None:
+                if completed:
+                    self.checkpoint.discard(locations, self.vehicle_type)
+                elif total:
+                    self.checkpoint.save(locations, self.vehicle_type, distance_matrix, time_matrix, known,
+                                         force=True)
+
+
+def plan_route(planner, locations, location_names, station_time, start_time_str, sparse_k=None,
+               portfolio=False, decompose=False, cluster_size=150, previous_matrix=None, previous_result=None):
+    """اجرای کامل ساخت ماتریس، حل و زمان‌بندی؛ خروجی دیکشنری نتایج یا None"""
+    planner.prune_leg_store(locations)
+    metrics = planner.metrics
+
+    if decompose:
+        with metrics.phase('decompose'):
+            decomposed = solve_decomposed(
+                locations, station_time,
+                lambda indices: planner.create_distance_time_matrices(
+                    [locations[i] for i in indices], sparse_k=sparse_k, store=False),
+                cluster_size=cluster_size
+            )
+        # ماتریس‌های ساخته‌شده فقط زیرماتریس خوشه‌ها و مرزها هستند و ماتریس قبلی این مجموعه نیستند
+        planner.last_matrix = None
+        if decomposed is None:
+            planner.notify('error', "خطا در محاسبه ماتریس‌های فاصله و زمان")
+            return None
+        planner.notify('info', f"مسئله به {decomposed['clusters']} خوشه تقسیم و به صورت موازی حل شد.")
+        route_points = decomposed['route_points']
+        distance_matrix = time_matrix = None
+        with metrics.phase('schedule'):
+            schedule = schedule_from_legs(decomposed['travel'], decomposed['distance'], station_time)
+    else:
+        with metrics.phase('matrix'):
+            distance_matrix, time_matrix = planner.create_distance_time_matrices(
+                locations, sparse_k=sparse_k, previous=previous_matrix)
+        if distance_matrix is None or time_matrix is None:
+            planner.notify('error', "خطا در محاسبه ماتریس‌های فاصله و زمان")
+            return None
+        if planner.estimated is not None and planner.estimated.any():
+            planner.notify('info', f"{int(planner.estimated.sum())} مسیر بدون درخواست به API برآورد شد.")
+
+        with metrics.phase('solve'):
+            if portfolio:
+                best = solve_portfolio(time_matrix, station_time, time_limit=adaptive_time_limit(len(locations)))
+                route_points = best['route_points'] if best else None
+                if best:
+                    first_solution, metaheuristic, seed = best['strategy']
+                    planner.notify('info', f"بهترین راهبرد: {first_solution} + {metaheuristic} (بذر {seed}) "
+                                           f"پس از {best['rounds']} دور")
+                    for round_number, cost in enumerate(best['history'], 1):
+                        metrics.record('nova_solver_objective', cost, at=round_number)
+            else:
+                trace = {}
+                route_points = solve_route(time_matrix, station_time, previous=previous_result,
+                                           locations=locations, trace=trace)
+                for at, cost in trace.get('objective', []):
+                    metrics.record('nova_solver_objective', cost, at=at)
+                for name in ('branches', 'failures', 'solutions'):
+                    metrics.count(f'nova_solver_{name}_total', trace.get(name, 0))
+        if not route_points:
+            return None
+        with metrics.phase('schedule'):
+            schedule = build_schedule(route_points, time_matrix, distance_matrix, station_time)
+
+    return {
+        'route_points': route_points,
+        'total_time': schedule['total_time'],
+        'total_distance': schedule['total_distance'],
+        'distance_matrix': distance_matrix,
+        'time_matrix': time_matrix,
+        'location_names': location_names,
+        'locations': list(locations),
+        'start_time_str': start_time_str,
+        'station_time': station_time,
+        'schedule': schedule
+    }
+
+
+def build_route_table(results):
+    """ساخت جدول مسیر به صورت برداری از زمان‌بندی محاسبه‌شده"""
+    schedule = results['schedule']
+    route = np.asarray(results['route_points'])
+    last = len(route) - 1
+    position = np.arange(len(route))
+    is_stop = (position > 0) & (position < last)
+
+    start = pd.Timestamp(datetime.strptime(results['start_time_str'], "%H:%M"))
+    arrival = (start + pd.to_timedelta(schedule['arrival'], unit='s')).strftime("%H:%M")
+    departure = (start + pd.to_timedelta(schedule['departure'], unit='s')).strftime("%H:%M")
+
+    travel_minutes = (schedule['travel_next'] // 60).astype(str)
+    distance_km = np.char.mod('%.1f', schedule['distance_next'] / 1000)
+
+    return pd.DataFrame({
+        'ردیف': position + 1,
+        'نام مکان': np.asarray(results['location_names'], dtype=object)[route],
+        'نوع': np.where(position == 0, 'نقطه شروع', np.where(position == last, 'نقطه پایان', 'نمایندگی')),
+        'زمان رسیدن': arrival,
+        'مدت توقف': np.where(is_stop, f"{int(results['station_time'])//60} دقیقه", "-"),
+        'زمان حرکت': np.where(position < last, departure, "-"),
+        'زمان سفر تا ایستگاه بعدی': np.where(schedule['travel_next'] > 0,
+                                            np.char.add(travel_minutes, ' دقیقه'), "-"),
+        'مسافت تا ایستگاه بعدی': np.where(position < last, np.char.add(distance_km, ' کیلومتر'), "-")
+    })
@@ -0,0 +1,191 @@
+import hashlib
+import json
+from datetime import datetime
+
+import folium
+import numpy as np
+import pandas as pd
+from folium import plugins
+
+from geo import fit_zoom, meters_per_pixel, simplify_polyline
+from solver import build_schedule
+
+ROUTE_COLORS = ['#1a237e', '#0d47a1', '#1565c0', '#1976d2', '#1e88e5']
+LARGE_ROUTE_STOPS = 150
+LARGE_ROUTE_LAYERS = 5
+
+STOP_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+        {radius: 6, color: '#0d47a1', weight: 1, fillColor: '#1e88e5', fillOpacity: 0.9});
+    marker.bindPopup('<div dir="rtl" style="text-align: right;">' + row[2] + '</div>');
+    return marker;
+};
+"""
+
+
+def route_map_key(results, mode='auto'):
+    """شناسه یکتای نقشه هر مسیر برای استفاده دوباره از نقشه ساخته‌شده"""
+    route = list(map(int, results['route_points']))
+    payload = json.dumps([
+        [list(map(float, results['locations'][i])) for i in route],
+        [str(results['location_names'][i]) for i in route],
+        np.asarray(results['schedule']['arrival']).tolist(),
+        int(results['station_time']), results['start_time_str'], mode
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _route_legs(planner, locations, route_points):
+    """هندسه و فاصله یال‌های مسیر از مسیرهای ذخیره‌شده (یا API در صورت نبود)"""
+    legs = []
+    for start_idx, end_idx in zip(route_points[:-1], route_points[1:]):
+        start, end = locations[start_idx], locations[end_idx]
+        leg = planner.stored_leg(start, end)
+        planner.metrics.count('nova_cache_lookups_total', cache='leg_store',
+                              result='miss' if leg is None else 'hit')
+        if leg is None:
+            leg = planner.get_route_neshan(start, end)
+        route_coords, distance = leg[:2]
+        legs.append((route_coords, distance))
+    return legs
+
+
+def build_route_map(planner, locations, route_points, location_names, time_matrix, station_time, start_time_str,
+                    schedule=None, mode='auto'):
+    """ایجاد نقشه Folium مسیر با جزئیات؛ خروجی (نقشه، زمان‌های رسیدن)
+
+    هندسه یال‌ها از مسیرهای ذخیره‌شده planner خوانده و در صورت نبود از API دریافت می‌شود.
+    mode یکی از 'detailed'، 'large' یا 'auto' است؛ در حالت خودکار مسیرهای
+    بیشتر از LARGE_ROUTE_STOPS ایستگاه به صورت سبک رسم می‌شوند.
+    """
+    if schedule is None:
+        schedule = build_schedule(route_points, time_matrix, None, station_time)
+    start_time = pd.Timestamp(datetime.strptime(start_time_str, "%H:%M"))
+    arrival_times = list((start_time + pd.to_timedelta(schedule['arrival'], unit='s')).strftime("%H:%M"))
+
+    if mode == 'auto':
+        mode = 'large' if len(route_points) > LARGE_ROUTE_STOPS else 'detailed'
+    legs = _route_legs(planner, locations, route_points)
+    if mode == 'large':
+        m = _large_route_map(locations, route_points, location_names, station_time, schedule, arrival_times, legs)
+    else:
+        m = _detailed_route_map(locations, route_points, location_names, station_time, schedule, arrival_times,
+                                legs)
+
+    folium.LayerControl().add_to(m)
+    plugins.Fullscreen().add_to(m)
+    plugins.MousePosition().add_to(m)
+
+    return m, arrival_times
+
+
+def _detailed_route_map(locations, route_points, location_names, station_time, schedule, arrival_times, legs):
+    """نقشه کامل با یک خط و یک نشانگر (با پنجره اطلاعات) برای هر یال و ایستگاه"""
+    center_lat = np.mean([loc[0] for loc in locations])
+    center_lng = np.mean([loc[1] for loc in locations])
+    m = folium.Map(location=[center_lat, center_lng], zoom_start=12)
+
+    for i, (route_coords, distance) in enumerate(legs):
+        duration = int(schedule['travel_next'][i])
+
+        if route_coords:
+            folium.PolyLine(
+                route_coords,
+                weight=4,
+                color=ROUTE_COLORS[i % len(ROUTE_COLORS)],
+                opacity=0.8,
+                popup=f"""
+                <div dir="rtl" style="font-family: Vazirmatn, sans-serif; text-align: right;">
+                    <b>مسیر {i+1}:</b><br>
+                    از: {location_names[route_points[i]]}<br>
+                    به: {location_names[route_points[i+1]]}<br>
+                    زمان حرکت: {arrival_times[i]}<br>
+                    زمان رسیدن: {arrival_times[i+1]}<br>
+                    مدت سفر: {duration/60:.0f} دقیقه<br>
+                    فاصله: {distance/1000:.1f} کیلومتر
+                </div>
+                """
+            ).add_to(m)
+
+    for i, point_idx in enumerate(route_points):
+        icon_color = 'red' if i == 0 else ('green' if i == len(route_points)-1 else 'blue')
+        folium.Marker(
+            locations[point_idx],
+            popup=folium.Popup(
+                f"""
+                <div dir="rtl" style="font-family: Vazirmatn, sans-serif; text-align: right;">
+                    <b>ایستگاه {i+1}: {location_names[point_idx]}</b><br>
+                    زمان رسیدن: {arrival_times[i]}<br>
+                    {'نقطه شروع' if i == 0 else f'زمان توقف: {station_time//60} دقیقه'}
+                </div>
+                """,
+                max_width=300
+            ),
+            icon=folium.Icon(color=icon_color)
+        ).add_to(m)
+
+    return m
+
+
+def _large_route_map(locations, route_points, location_names, station_time, schedule, arrival_times, legs):
+    """نقشه سبک برای مسیرهای بزرگ
+
+    رسم روی canvas، ایستگاه‌ها به صورت نشانگرهای دایره‌ای خوشه‌بندی‌شده،
+    یال‌ها در چند لایه پیوسته و ساده‌شده متناسب با بزرگ‌نمایی اولیه نقشه.
+    """
+    points = np.asarray([locations[i] for i in route_points], dtype=float)
+    zoom = fit_zoom(points)
+    # خطای ساده‌سازی کمتر از یک پیکسل در دو سطح بزرگ‌نمایی جلوتر؛ Leaflet در
+    # بزرگ‌نمایی‌های کمتر با smooth_factor خودش بیشتر ساده می‌کند
+    tolerance = meters_per_pixel(points[:, 0].mean(), zoom + 2)
+
+    m = folium.Map(prefer_canvas=True)
+    m.fit_bounds([points.min(axis=0).tolist(), points.max(axis=0).tolist()])
+
+    groups = np.array_split(np.arange(len(legs)), min(LARGE_ROUTE_LAYERS, len(legs)))
+    for k, group in enumerate(groups):
+        coords = []
+        for i in group:
+            route_coords = legs[i][0] or [list(locations[route_points[i]]), list(locations[route_points[i + 1]])]
+            coords.extend(route_coords if not coords else route_coords[1:])
+        first, last = int(group[0]), int(group[-1]) + 1
+        distance = sum(legs[i][1] or 0 for i in group)
+        duration = int(schedule['arrival'][last] - schedule['arrival'][first])
+        layer = folium.FeatureGroup(name=f"ایستگاه {first + 1} تا {last + 1}")
+        folium.PolyLine(
+            simplify_polyline(coords, tolerance),
+            weight=4,
+            color=ROUTE_COLORS[k % len(ROUTE_COLORS)],
+            opacity=0.8,
+            smooth_factor=1.5,
+            tooltip=f"ایستگاه {first + 1} ({arrival_times[first]}) تا {last + 1} ({arrival_times[last]})، "
+                    f"{duration/3600:.1f} ساعت، {distance/1000:.1f} کیلومتر"
+        ).add_to(layer)
+        layer.add_to(m)
+
+    stops = [
+        [float(points[i, 0]), float(points[i, 1]),
+         f"<b>ایستگاه {i + 1}: {location_names[route_points[i]]}</b><br>"
+         f"زمان رسیدن: {arrival_times[i]}<br>زمان توقف: {station_time//60} دقیقه"]
+        for i in range(1, len(route_points) - 1)
+    ]
+    plugins.FastMarkerCluster(stops, callback=STOP_MARKER_CALLBACK, name="ایستگاه‌ها",
+                              options={'disableClusteringAtZoom': 16}).add_to(m)
+
+    for i, (label, color) in ((0, ("نقطه شروع", 'red')), (len(route_points) - 1, ("نقطه پایان", 'green'))):
+        folium.Marker(
+            points[i].tolist(),
+            popup=folium.Popup(
+                f"""
+                <div dir="rtl" style="font-family: Vazirmatn, sans-serif; text-align: right;">
+                    <b>{label}: {location_names[route_points[i]]}</b><br>
+                    زمان: {arrival_times[i]}
+                </div>
+                """,
+                max_width=300
+            ),
+            icon=folium.Icon(color=color)
+        ).add_to(m)
+
+    return m
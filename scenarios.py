@@ -0,0 +1,90 @@
+import hashlib
+import json
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from solver import build_schedule, solve_subsets
+
+ALL_STOPS = "همه نمایندگی‌ها"
+
+
+class SweepFailed(Exception):
+    """سناریوها حل نشدند (مثلاً توقف ناگهانی فرایندهای حل)"""
+
+
+def scenario_key(result_key, subsets, services, start_times):
+    """شناسه یکتای هر مجموعه سناریو روی یک نتیجه"""
+    payload = json.dumps([
+        result_key,
+        {name: list(map(int, nodes)) for name, nodes in subsets.items()},
+        {name: np.asarray(value).tolist() for name, value in services.items()},
+        list(start_times)
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def stop_attributes(locations, branches):
+    """ستون‌های فایل نمایندگی‌ها به ترتیب ایستگاه‌های مسئله (بدون نقطه شروع)، با تطبیق مختصات
+
+    مختصات با دقت float32 (دقت خواندن فایل) مقایسه می‌شوند.
+    """
+    stops = pd.DataFrame(np.asarray(locations[1:], dtype=np.float32).reshape(-1, 2), columns=['lat', 'lng'])
+    branches = branches.assign(lat=branches['lat'].astype(np.float32), lng=branches['lng'].astype(np.float32))
+    return stops.merge(branches.drop_duplicates(['lat', 'lng']), on=['lat', 'lng'], how='left')
+
+
+def group_subsets(groups):
+    """زیرمجموعه‌های نقاط: همه ایستگاه‌ها و ایستگاه‌های هر مقدار groups (به ترتیب ایستگاه‌ها)"""
+    groups = pd.Series(groups).reset_index(drop=True)
+    subsets = {ALL_STOPS: list(range(len(groups) + 1))}
+    for value in groups.dropna().unique():
+        subsets[str(value)] = [0] + (np.flatnonzero((groups == value).to_numpy()) + 1).tolist()
+    return subsets
+
+
+def run_sweep(time_matrix, distance_matrix, subsets, services, start_times, routes=None, time_limit=None,
+              max_workers=None, progress=None):
+    """ارزیابی همه ترکیب‌های زیرمجموعه، زمان توقف و زمان شروع روی یک ماتریس؛ خروجی جدول مقایسه
+
+    subsets نام هر زیرمجموعه و شماره نقاط آن (انبار در ابتدا)، services نام و
+    زمان توقف (ثانیه، عدد یا آرایه برای هر نقطه) و routes مسیرهای از پیش
+    حل‌شده است. ترتیب بهینه فقط به زیرمجموعه بستگی دارد، پس هر زیرمجموعه
+    یک بار (به صورت موازی) حل و بقیه پارامترها با زمان‌بندی برداری ارزیابی می‌شوند.
+    """
+    routes = dict(routes or {})
+    pending = [name for name in subsets if name not in routes]
+    if progress:
+        progress(0, len(pending))
+    try:
+        solved = solve_subsets(time_matrix, [subsets[name] for name in pending], time_limit, max_workers)
+    except BrokenProcessPool:
+        raise SweepFailed("فرایندهای حل سناریوها ناگهان متوقف شدند (مثلاً به دلیل کمبود حافظه)؛ "
+                          "لطفاً سناریوها را دوباره اجرا کنید یا تعداد زیرمجموعه‌ها را کم کنید") from None
+    routes.update(zip(pending, solved))
+    if progress:
+        progress(len(pending), len(pending))
+
+    rows = []
+    for subset, nodes in subsets.items():
+        route = routes[subset]
+        for service, station_time in services.items():
+            schedule = None if route is None else build_schedule(route, time_matrix, distance_matrix, station_time)
+            for start_time_str in start_times:
+                row = {'نمایندگی‌ها': subset, 'تعداد توقف': len(nodes) - 1, 'زمان توقف': service,
+                       'زمان شروع': start_time_str}
+                if schedule is None:
+                    rows.append(dict(row, **{'زمان پایان': "حل نشد"}))
+                    continue
+                start = datetime.strptime(start_time_str, "%H:%M")
+                end = start + timedelta(seconds=int(schedule['total_time']))
+                days = (end.date() - start.date()).days
+                rows.append(dict(row, **{
+                    'زمان پایان': end.strftime("%H:%M") + (f" (+{days} روز)" if days else ""),
+                    'مدت کل (ساعت)': round(schedule['total_time'] / 3600, 2),
+                    'زمان رانندگی (ساعت)': round(int(schedule['travel_next'].sum()) / 3600, 2),
+                    'مسافت کل (کیلومتر)': round(schedule['total_distance'] / 1000, 1)
+                }))
+    return pd.DataFrame(rows)
@@ -0,0 +1,387 @@
+import itertools
+import mmap
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import numpy as np
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+
+from leg_cache import PIN_SUFFIX
+
+
+PORTFOLIO = [
+    ('PATH_CHEAPEST_ARC', 'GUIDED_LOCAL_SEARCH'),
+    ('SAVINGS', 'GUIDED_LOCAL_SEARCH'),
+    ('CHRISTOFIDES', 'GUIDED_LOCAL_SEARCH'),
+    ('PARALLEL_CHEAPEST_INSERTION', 'GUIDED_LOCAL_SEARCH'),
+    ('PATH_CHEAPEST_ARC', 'SIMULATED_ANNEALING'),
+    ('LOCAL_CHEAPEST_INSERTION', 'TABU_SEARCH'),
+    ('GLOBAL_CHEAPEST_ARC', 'GENERIC_TABU_SEARCH'),
+]
+STALL_MIN_FRACTION = 0.1
+_pin_ids = itertools.count()
+
+
+def build_transit_matrix(time_matrix, station_time, depot=0):
+    """ماتریس صحیح زمان سفر به همراه زمان توقف در نقطه مبدأ هر یال
+
+    depot اندیس انبار (بدون زمان توقف) یا None برای زیرمسئله‌های بدون انبار است.
+    """
+    transit = np.asarray(time_matrix, dtype=np.int64).copy()
+    service = np.full(transit.shape[0], int(station_time), dtype=np.int64)
+    if depot is not None:
+        service[depot] = 0
+    transit += service[:, None]
+    np.fill_diagonal(transit, 0)
+    return transit
+
+
+def register_transit(routing, manager, transit):
+    """ثبت ماتریس در OR-Tools به صورت بومی (یا با callback در نسخه‌های قدیمی)"""
+    if hasattr(routing, 'RegisterTransitMatrix'):
+        return routing.RegisterTransitMatrix(transit.tolist())
+
+    values = transit.tolist()
+
+    def time_callback(from_index, to_index):
+        return values[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+
+    return routing.RegisterTransitCallback(time_callback)
+
+
+def solve_transit(transit, first_solution='PATH_CHEAPEST_ARC', metaheuristic='GUIDED_LOCAL_SEARCH',
+                  time_limit=30, seed=0, initial_route=None, stall_coefficient=None, trace=None):
+    """حل روی ماتریس transit (انبار در گره ۰)؛ خروجی (هزینه، ترتیب نقاط) یا (None, None)
+
+    seed غیر صفر ترتیب گره‌ها را به صورت تصادفی جابه‌جا می‌کند تا جستجو
+    از نقطه دیگری شروع شود؛ initial_route مسیر قبلی برای شروع گرم است.
+    با stall_coefficient جستجو وقتی متوقف می‌شود که بدون بهبود، stall_coefficient
+    برابر زمان یافتن بهترین جواب (و دست‌کم STALL_MIN_FRACTION از time_limit) گذشته باشد؛ این شرط با رسیدن هر
+    جواب جدید بررسی می‌شود.
+    اگر trace یک دیکشنری باشد، هزینه هر جواب یافته‌شده در طول زمان و آمار
+    جستجو (branches، failures، solutions) در آن ثبت می‌شود.
+    """
+    size = transit.shape[0]
+    perm = np.arange(size)
+    if seed:
+        perm[1:] = np.random.default_rng(seed).permutation(np.arange(1, size))
+    values = transit[np.ix_(perm, perm)]
+    position = np.empty(size, dtype=np.int64)
+    position[perm] = np.arange(size)
+
+    manager = pywrapcp.RoutingIndexManager(size, 1, 0)
+    routing = pywrapcp.RoutingModel(manager)
+
+    transit_callback_index = register_transit(routing, manager, values)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    started = time.perf_counter()
+    best = {'cost': None, 'at': 0.0}
+    objective = trace.setdefault('objective', []) if trace is not None else None
+
+    min_stall = STALL_MIN_FRACTION * time_limit
+
+    def on_solution():
+        # یک بار برای هر جواب اجرا می‌شود، نه در هر گره جستجو
+        cost, at = routing.CostVar().Value(), time.perf_counter() - started
+        if objective is not None:
+            objective.append((round(at, 3), cost))
+        if best['cost'] is None or cost < best['cost']:
+            best['cost'], best['at'] = cost, at
+        elif stall_coefficient and at - best['at'] > max(min_stall, stall_coefficient * best['at']):
+            routing.solver().FinishCurrentSearch()
+
+    routing.AddAtSolutionCallback(on_solution)
+
+    routing.AddDimension(
+        transit_callback_index,
+        0,
+        max(24 * 3600, int(values.max(initial=0)) * size),
+        True,
+        'Time'
+    )
+
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = getattr(
+        routing_enums_pb2.FirstSolutionStrategy, first_solution)
+    search_parameters.local_search_metaheuristic = getattr(
+        routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic)
+    search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+
+    if initial_route is not None and len(initial_route) == size + 1:
+        routing.CloseModelWithParameters(search_parameters)
+        stops = [manager.NodeToIndex(int(position[node])) for node in initial_route[1:-1]]
+        initial = routing.ReadAssignmentFromRoutes([stops], True)
+        solution = routing.SolveFromAssignmentWithParameters(initial, search_parameters) if initial else None
+    else:
+        solution = routing.SolveWithParameters(search_parameters)
+    if trace is not None:
+        solver = routing.solver()
+        trace.update(branches=solver.Branches(), failures=solver.Failures(), solutions=solver.Solutions())
+    if not solution:
+        return None, None
+
+    route_points = []
+    index = routing.Start(0)
+    while not routing.IsEnd(index):
+        route_points.append(int(perm[manager.IndexToNode(index)]))
+        index = solution.Value(routing.NextVar(index))
+    route_points.append(int(perm[manager.IndexToNode(index)]))
+    return solution.ObjectiveValue(), route_points
+
+
+def adaptive_time_limit(size, warm=False, cap=30):
+    """سقف زمان حل متناسب با اندازه مسئله (و کوتاه‌تر برای شروع گرم)"""
+    limit = min(cap, max(1.0, 0.25 * size))
+    if warm:
+        limit = max(1.0, limit / 3)
+    return limit
+
+
+def warm_start_route(previous_route, previous_locations, locations, transit, max_change=0.2):
+    """ساخت مسیر اولیه از مسیر قبلی با حذف نقاط حذف‌شده و درج ارزان‌ترین نقاط جدید
+
+    اگر تغییر مجموعه نقاط بیشتر از max_change باشد None برمی‌گرداند.
+    """
+    index = {loc: i for i, loc in enumerate(locations)}
+    route = []
+    for node in previous_route[1:-1]:
+        i = index.get(previous_locations[node])
+        if i is not None and i != 0 and i not in route:
+            route.append(i)
+
+    visited = set(route)
+    missing = [i for i in range(1, len(locations)) if i not in visited]
+    removed = len(previous_route) - 2 - len(route)
+    if not route or len(missing) + removed > max(2, max_change * len(locations)):
+        return None
+
+    route = [0] + route + [0]
+    for node in missing:
+        tour = np.asarray(route)
+        delta = transit[tour[:-1], node] + transit[node, tour[1:]] - transit[tour[:-1], tour[1:]]
+        route.insert(int(np.argmin(delta)) + 1, node)
+    return route
+
+
+def solve_path(transit, time_limit=5):
+    """بهترین ترتیب گره‌های میانی با ابتدای ثابت (گره اول) و انتهای ثابت (گره آخر)"""
+    size = transit.shape[0]
+    if size <= 3:
+        return list(range(size))
+
+    manager = pywrapcp.RoutingIndexManager(size, 1, [0], [size - 1])
+    routing = pywrapcp.RoutingModel(manager)
+    transit_callback_index = register_transit(routing, manager, transit)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+    search_parameters.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
+    search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+
+    solution = routing.SolveWithParameters(search_parameters)
+    if not solution:
+        return list(range(size))
+
+    order = []
+    index = routing.Start(0)
+    while not routing.IsEnd(index):
+        order.append(manager.IndexToNode(index))
+        index = solution.Value(routing.NextVar(index))
+    order.append(manager.IndexToNode(index))
+    return order
+
+
+def solve_route(time_matrix, station_time, time_limit=None, previous=None, locations=None,
+                stall_coefficient=2.5, trace=None):
+    """حل مسئله فروشنده دوره‌گرد؛ خروجی ترتیب نقاط مسیر یا None
+
+    previous نتیجه حل قبلی (route_points و locations) است؛ اگر مجموعه نقاط
+    کمی تغییر کرده باشد جستجو از همان مسیر شروع می‌شود.
+    """
+    transit = build_transit_matrix(time_matrix, station_time)
+    initial_route = None
+    if previous is not None and locations is not None:
+        initial_route = warm_start_route(previous['route_points'], previous['locations'], locations, transit)
+    if time_limit is None:
+        time_limit = adaptive_time_limit(transit.shape[0], warm=initial_route is not None)
+    _, route_points = solve_transit(transit, time_limit=time_limit, initial_route=initial_route,
+                                    stall_coefficient=stall_coefficient, trace=trace)
+    return route_points
+
+
+_worker_transit = None
+
+
+def _init_worker(time_matrix, station_time):
+    global _worker_transit
+    if isinstance(time_matrix, str):
+        time_matrix = np.load(time_matrix, mmap_mode='r')
+    _worker_transit = build_transit_matrix(time_matrix, station_time)
+
+
+@contextmanager
+def _shared_matrix(time_matrix):
+    """ماتریس برای فرایندهای حل: مسیر پیوندی به فایل .npy نگاشته‌شده، وگرنه خود ماتریس
+
+    فرایندهای حل به جای دریافت کپی ماتریس، همان فایل را نگاشت می‌کنند. یک
+    پیوند سخت موقت (PIN_SUFFIX) تا پایان کار نگه داشته می‌شود تا هرس یا
+    جایگزینی فایل در انبار ماتریس‌ها فرایندها را از کار نیندازد؛ اگر فایل
+    دیگر همان محتوای نگاشت فعلی را نداشته باشد، خود ماتریس فرستاده می‌شود.
+    """
+    if not (isinstance(time_matrix, np.memmap) and isinstance(time_matrix.base, mmap.mmap)
+            and time_matrix.filename):
+        yield time_matrix
+        return
+    pin = f"{time_matrix.filename}.{os.getpid()}.{next(_pin_ids)}{PIN_SUFFIX}"
+    try:
+        os.link(time_matrix.filename, pin)
+        pinned = np.load(pin, mmap_mode='r')
+        # روی همان فایل، هر دو نگاشت صفحه‌های مشترک را می‌خوانند و مقایسه ارزان است
+        same = pinned.shape == time_matrix.shape and np.array_equal(pinned, time_matrix)
+        del pinned
+    except (OSError, ValueError):
+        same = False
+    try:
+        yield pin if same else np.asarray(time_matrix)
+    finally:
+        try:
+            os.remove(pin)
+        except OSError:
+            pass
+
+
+def _solve_task(first_solution, metaheuristic, seed, time_limit, initial_route):
+    return solve_transit(_worker_transit, first_solution, metaheuristic, time_limit, seed, initial_route)
+
+
+def solve_portfolio(time_matrix, station_time, time_limit=30, strategies=PORTFOLIO, seeds=(0, 1),
+                    max_workers=None, rounds=3, tolerance=0.001):
+    """حل موازی با چند راهبرد و بذر تصادفی در چند دور و توقف زودهنگام پس از همگرایی
+
+    هر دور از بهترین مسیر دور قبلِ همان راهبرد شروع می‌شود. اگر بهبود بهترین
+    هزینه کمتر از tolerance باشد و دست‌کم دو راهبرد به آن رسیده باشند، جستجو متوقف می‌شود.
+    """
+    tasks = [(first, meta, seed) for first, meta in strategies for seed in seeds]
+    max_workers = max_workers or min(len(tasks), os.cpu_count() or 1)
+    waves = -(-len(tasks) // max_workers)
+    round_limit = time_limit / rounds / waves
+    best = {}
+    history = []
+
+    with _shared_matrix(time_matrix) as shared, \
+            ProcessPoolExecutor(max_workers=max_workers, mp_context=mp.get_context('spawn'),
+                                initializer=_init_worker, initargs=(shared, station_time)) as executor:
+        for _ in range(rounds):
+            futures = {
+                executor.submit(_solve_task, *task, round_limit, best.get(task, (None, None))[1]): task
+                for task in tasks
+            }
+            for future in as_completed(futures):
+                cost, route_points = future.result()
+                task = futures[future]
+                if cost is not None and (task not in best or cost < best[task][0]):
+                    best[task] = (cost, route_points)
+            if not best:
+                continue
+
+            round_best = min(cost for cost, _ in best.values())
+            history.append(round_best)
+            agreeing = sum(cost <= round_best * (1 + tolerance) for cost, _ in best.values())
+            if len(history) > 1 and history[-2] - round_best <= tolerance * history[-2] and agreeing >= 2:
+                break
+
+    if not best:
+        return None
+    winner, (cost, route_points) = min(best.items(), key=lambda item: item[1][0])
+    return {
+        'route_points': route_points,
+        'cost': cost,
+        'strategy': winner,
+        'rounds': len(history),
+        'history': history,
+        'costs': {task: cost for task, (cost, _) in best.items()}
+    }
+
+
+_worker_matrix = None
+
+
+def _init_subset_worker(time_matrix):
+    global _worker_matrix
+    _worker_matrix = np.load(time_matrix, mmap_mode='r') if isinstance(time_matrix, str) else time_matrix
+
+
+def _solve_subset(nodes, time_limit, time_matrix=None):
+    if len(nodes) <= 2:
+        return list(nodes) + [nodes[0]]
+    time_matrix = _worker_matrix if time_matrix is None else time_matrix
+    _, order = solve_transit(build_transit_matrix(time_matrix[np.ix_(nodes, nodes)], 0), time_limit=time_limit)
+    return None if order is None else [nodes[i] for i in order]
+
+
+def solve_subsets(time_matrix, subsets, time_limit=None, max_workers=None):
+    """حل مسیر چند زیرمجموعه از نقاط یک ماتریس به صورت موازی
+
+    هر زیرمجموعه فهرست شماره نقاط با انبار در ابتدای آن است؛ خروجی برای هر
+    زیرمجموعه مسیر به همان شماره‌ها یا None. زمان توقف در هر ایستگاه یک بار
+    به مجموع اضافه می‌شود و ترتیب بهینه را تغییر نمی‌دهد، پس بدون آن حل می‌شود.
+    """
+    subsets = [[int(node) for node in nodes] for nodes in subsets]
+    limits = [time_limit or adaptive_time_limit(len(nodes)) for nodes in subsets]
+    if len(subsets) <= 1:
+        return [_solve_subset(nodes, limit, time_matrix) for nodes, limit in zip(subsets, limits)]
+
+    max_workers = max_workers or min(len(subsets), os.cpu_count() or 1)
+    with _shared_matrix(time_matrix) as shared, \
+            ProcessPoolExecutor(max_workers=max_workers, mp_context=mp.get_context('spawn'),
+                                initializer=_init_subset_worker, initargs=(shared,)) as executor:
+        futures = [executor.submit(_solve_subset, nodes, limit) for nodes, limit in zip(subsets, limits)]
+        return [future.result() for future in futures]
+
+
+def build_schedule(route_points, time_matrix, distance_matrix, station_time):
+    """محاسبه برداری زمان رسیدن، حرکت و سفر هر ایستگاه (بر حسب ثانیه از شروع)
+
+    station_time یک عدد یا آرایه زمان توقف هر نقطه (به ترتیب شماره نقاط) است.
+    """
+    route = np.asarray(route_points)
+    if np.ndim(station_time):
+        station_time = np.asarray(station_time)[route]
+    travel = np.asarray(time_matrix)[route[:-1], route[1:]]
+    if distance_matrix is None:
+        distance = np.zeros_like(travel)
+    else:
+        distance = np.asarray(distance_matrix)[route[:-1], route[1:]]
+    return schedule_from_legs(travel, distance, station_time)
+
+
+def schedule_from_legs(travel, distance, station_time):
+    """زمان‌بندی از زمان و فاصله یال‌های پشت سر هم مسیر
+
+    station_time یک عدد یا آرایه زمان توقف هر ایستگاه به ترتیب مسیر است.
+    """
+    travel = np.asarray(travel).astype(np.int64)
+    distance = np.asarray(distance).astype(np.int64)
+
+    service = np.broadcast_to(np.asarray(station_time).astype(np.int64), (len(travel) + 1,)).copy()
+    service[0] = 0
+    service[-1] = 0
+
+    arrival = np.concatenate(([0], np.cumsum(service[:-1] + travel)))
+    return {
+        'arrival': arrival,
+        'departure': arrival + service,
+        'service': service,
+        'travel_next': np.append(travel, 0),
+        'distance_next': np.append(distance, 0),
+        'total_time': int(arrival[-1]),
+        'total_distance': int(distance.sum())
+    }
@@ -0,0 +1,30 @@
+import json
+
+import pandas as pd
+
+import nova_cli
+from benchmark import synthetic_instance
+
+
+def test_same_stem_in_two_formats_writes_separate_outputs(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    inputs = tmp_path / 'inputs'
+    inputs.mkdir()
+    for size, suffix in ((4, 'csv'), (6, 'xlsx')):
+        locations, names = synthetic_instance(size)
+        frame = pd.DataFrame({'name': names[1:], 'lat': [lat for lat, _ in locations[1:]],
+                              'lng': [lng for _, lng in locations[1:]]})
+        if suffix == 'csv':
+            frame.to_csv(inputs / 'depot.csv', index=False)
+        else:
+            frame.to_excel(inputs / 'depot.xlsx', index=False)
+
+    output = tmp_path / 'output'
+    code = nova_cli.main([str(inputs), '-o', str(output), '--api-key', 'test', '--jobs', '1',
+                          '--requests-per-second', '1000', '--direction-url', server.direction_url,
+                          '--distance-matrix-url', server.distance_matrix_url])
+    assert code == 0
+    assert len(pd.read_csv(output / 'depot_csv_schedule.csv')) == 4 + 2
+    assert len(pd.read_csv(output / 'depot_xlsx_schedule.csv')) == 6 + 2
+    assert json.loads((output / 'depot_xlsx_metrics.json').read_text(encoding='utf-8'))['stops'] == 6
+    assert len(json.loads((output / 'summary.json').read_text(encoding='utf-8'))) == 2
@@ -0,0 +1,43 @@
+import numpy as np
+
+from benchmark import synthetic_instance
+from decomposition import _service_transit, cluster_stops, solve_decomposed
+from geo import haversine_matrix
+from solver import build_schedule, build_transit_matrix, schedule_from_legs, solve_route
+
+
+def test_service_transit_matches_solver_transit():
+    locations, _ = synthetic_instance(6)
+    time_matrix = haversine_matrix(locations).astype(np.int64)
+    nodes = [4, 0, 2]
+    sub = time_matrix[np.ix_(nodes, nodes)]
+    assert np.array_equal(_service_transit(nodes, sub, 900), build_transit_matrix(sub, 900, depot=1))
+    assert np.array_equal(_service_transit([4, 2], sub[::2, ::2], 900),
+                          build_transit_matrix(sub[::2, ::2], 900, depot=None))
+    assert (np.diag(_service_transit([4, 2], sub[::2, ::2], 900)) == 0).all()
+
+
+def test_decomposed_route_agrees_with_direct_solve():
+    locations, _ = synthetic_instance(40, seed=2)
+    distance = (haversine_matrix(locations) * 1.3).astype(np.int64)
+    duration = (distance / 8.3).astype(np.int64)
+    fetched = []
+
+    def fetch_matrix(indices):
+        fetched.append(len(indices))
+        return distance[np.ix_(indices, indices)], duration[np.ix_(indices, indices)]
+
+    decomposed = solve_decomposed(locations, 900, fetch_matrix, cluster_size=15, max_workers=2)
+    route = decomposed['route_points']
+    assert decomposed['clusters'] == len(cluster_stops(locations, 15)) > 1
+    assert route[0] == route[-1] == 0 and sorted(route[:-1]) == list(range(len(locations)))
+    assert max(fetched) < len(locations)
+
+    # زمان و فاصله یال‌ها همان مقادیر ماتریس کامل در طول مسیر است
+    schedule = schedule_from_legs(decomposed['travel'], decomposed['distance'], 900)
+    full = build_schedule(route, duration, distance, 900)
+    assert schedule['total_time'] == full['total_time']
+    assert schedule['total_distance'] == full['total_distance']
+
+    direct = build_schedule(solve_route(duration, 900, time_limit=5), duration, distance, 900)
+    assert schedule['total_time'] <= direct['total_time'] * 1.15
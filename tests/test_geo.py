@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from geo import GridIndex, decode_polyline, encode_polyline, haversine_matrix, points_in_polygon
+
+
+def test_polyline_reference_encoding():
+    coords = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+    assert encode_polyline(coords) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@") == coords
+
+
+def test_polyline_round_trip():
+    rng = np.random.default_rng(0)
+    coords = np.round(rng.uniform([-89, -179], [89, 179], size=(500, 2)), 5).tolist()
+    coords += [[35.7, 51.4], [35.7, 51.4], [0.0, 0.0], [-0.00001, 0.00001]]
+    decoded = decode_polyline(encode_polyline(coords))
+    assert np.allclose(decoded, coords, atol=1e-9, rtol=0)
+    assert decode_polyline(encode_polyline([])) == []
+
+
+@pytest.fixture(scope='module')
+def index_points():
+    rng = np.random.default_rng(1)
+    centers = rng.uniform([35.6, 51.2], [35.8, 51.55], size=(20, 2))
+    points = centers[rng.integers(20, size=5000)] + rng.normal(0, 0.01, size=(5000, 2))
+    points[rng.choice(5000, 50, replace=False)] = np.nan
+    return points
+
+
+def test_grid_index_bounds_and_polygon_match_brute_force(index_points):
+    index = GridIndex(index_points)
+    low, high = np.array([35.65, 51.3]), np.array([35.72, 51.41])
+    brute = np.flatnonzero(((index_points >= low) & (index_points <= high)).all(axis=1))
+    assert np.array_equal(np.sort(index.within_bounds(low, high)), brute)
+
+    polygon = [[35.62, 51.25], [35.78, 51.3], [35.7, 51.5], [35.64, 51.42]]
+    brute = np.flatnonzero(points_in_polygon(index_points, polygon))
+    assert np.array_equal(np.sort(index.within_polygon(polygon)), brute)
+    assert len(index.within_bounds([10, 10], [11, 11])) == 0
+
+
+@pytest.mark.parametrize('center', [(35.7, 51.4), (35.6, 51.2), (36.5, 52.5)])
+def test_grid_index_radius_and_nearest_match_brute_force(index_points, center):
+    index = GridIndex(index_points)
+    distances = haversine_matrix([center], index_points)[0]
+    valid = np.isfinite(distances)
+
+    found = index.within_radius(center, 3000)
+    assert np.array_equal(np.sort(found), np.flatnonzero(valid & (distances <= 3000)))
+    assert np.all(np.diff(distances[found]) >= 0)
+
+    for k in (1, 10, 200):
+        nearest = index.nearest(center, k)
+        assert len(nearest) == k
+        assert np.allclose(distances[nearest], np.sort(distances[valid])[:k])
+    assert len(index.nearest(center, 10 ** 6)) == valid.sum()
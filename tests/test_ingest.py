@@ -0,0 +1,136 @@
+import zipfile
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+from openpyxl.cell.rich_text import CellRichText, TextBlock
+from openpyxl.cell.text import InlineFont
+from openpyxl.utils.datetime import CALENDAR_MAC_1904
+
+from ingest import LocationFileError, XlsxSheetReader, _excel_chunks, read_locations
+
+
+def streamed(path, chunk_rows=2):
+    return pd.concat(list(_excel_chunks(path, chunk_rows)), ignore_index=True)
+
+
+def values(frame):
+    # نوع ستون‌ها به تکه‌بندی بستگی دارد (مثلاً ستونی که در یک تکه خالی است)؛ مقدارها مقایسه می‌شوند
+    return frame.astype(object).where(frame.notna(), None).to_numpy().tolist()
+
+
+def assert_matches_read_excel(path):
+    frame, expected = streamed(path), pd.read_excel(path, engine='openpyxl')
+    assert list(frame.columns) == list(expected.columns)
+    assert values(frame) == values(expected)
+
+
+def save(wb, tmp_path, name='branches.xlsx'):
+    path = tmp_path / name
+    wb.save(path)
+    return path
+
+
+def test_values_match_read_excel(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['name', 'lat', 'lng', 'count', 'active', 'city'])
+    ws.append(['شعبه ۱', 35.7, 51.4, 3, True, 'تهران'])
+    ws.append(['شعبه ۲', 35.75, 51.35, -2, False, 'تهران'])
+    ws.append(['شعبه ۳', 35.8, 51.5, 1.5e3, True, 'کرج'])
+    ws.append(['شعبه ۴', 35.65, 51.45, 0, None, None])
+    assert_matches_read_excel(save(wb, tmp_path))
+
+
+def test_dates_times_and_durations(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['name', 'opened', 'visited', 'opens', 'window'])
+    ws.append(['a', date(2024, 3, 20), datetime(2024, 3, 20, 8, 30), time(8, 0), timedelta(hours=26)])
+    ws.append(['b', date(1900, 2, 1), datetime(2023, 12, 31, 23, 59, 59), time(17, 45), timedelta(minutes=90)])
+    for row in ws.iter_rows(min_row=2, min_col=5, max_col=5):
+        row[0].number_format = '[h]:mm'
+    ws['B3'].number_format = 'yyyy/mm/dd'
+    path = save(wb, tmp_path)
+    assert_matches_read_excel(path)
+    rows = list(XlsxSheetReader(path).rows())
+    assert rows[1][1:] == [datetime(2024, 3, 20), datetime(2024, 3, 20, 8, 30), time(8, 0), timedelta(hours=26)]
+
+
+def test_1904_date_system(tmp_path):
+    wb = Workbook()
+    wb.epoch = CALENDAR_MAC_1904
+    wb.active.append(['name', 'opened'])
+    wb.active.append(['a', datetime(2024, 3, 20, 12, 0)])
+    path = save(wb, tmp_path)
+    assert_matches_read_excel(path)
+    assert list(XlsxSheetReader(path).rows())[1][1] == datetime(2024, 3, 20, 12, 0)
+
+
+def test_inline_rich_text_keeps_every_run(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['name', 'note'])
+    ws.append([CellRichText(['شعبه ', TextBlock(InlineFont(b=True), 'مرکزی')]),
+               CellRichText([TextBlock(InlineFont(i=True), 'a'), 'b', 'c'])])
+    path = save(wb, tmp_path)
+    assert 't="inlineStr"' in zipfile.ZipFile(path).read('xl/worksheets/sheet1.xml').decode()
+    assert list(XlsxSheetReader(path).rows())[1] == ['شعبه مرکزی', 'abc']
+    assert_matches_read_excel(path)
+
+
+def test_sparse_cells_and_blank_rows(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['name', 'lat', 'lng', 'city'])
+    ws['A2'], ws['D2'] = 'a', 'تهران'
+    ws['B4'], ws['C4'] = 35.7, 51.4
+    ws['A6'], ws['B6'], ws['C6'] = 'c', 35.8, 51.5
+    ws['F6'] = 'خارج از سرستون'
+    ws['B8'].number_format = '0.00'
+    path = save(wb, tmp_path)
+    frame = streamed(path)
+    assert len(frame) == 3
+    assert list(frame.columns) == ['name', 'lat', 'lng', 'city']
+    expected = pd.read_excel(path, engine='openpyxl').dropna(how='all').reset_index(drop=True)
+    assert values(frame) == values(expected[frame.columns])
+
+
+def test_reads_first_sheet_in_workbook_order(tmp_path):
+    wb = Workbook()
+    wb.active.title = 'other'
+    wb.active.append(['x'])
+    wb.active.append([1])
+    ws = wb.create_sheet('branches', 0)
+    ws.append(['name', 'lat', 'lng'])
+    ws.append(['a', 35.7, 51.4])
+    wb.create_sheet('empty')
+    path = save(wb, tmp_path)
+    assert list(XlsxSheetReader(path).rows())[0] == ['name', 'lat', 'lng']
+    assert_matches_read_excel(path)
+
+
+def test_read_locations_from_excel(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['name', 'lat', 'lng', 'city'])
+    for i in range(10):
+        ws.append([f"شعبه {i}", 35.7 + i / 100, 51.4, 'تهران' if i % 2 else 'کرج'])
+    ws.append(['تکراری', 35.7, 51.4, 'تهران'])
+    ws.append(['بدون مختصات', None, 51.4, 'تهران'])
+    ws.append([None, 35.9, 51.4, 'تهران'])
+    df, report = read_locations(save(wb, tmp_path), chunk_rows=4)
+    assert report == {'rows': 13, 'invalid': 2, 'duplicates': 1}
+    assert list(df['name']) == [f"شعبه {i}" for i in range(10)]
+    assert df['lat'].dtype == np.float32 and df['city'].dtype == 'category'
+
+
+def test_rejects_unknown_format_and_missing_columns(tmp_path):
+    with pytest.raises(LocationFileError):
+        read_locations(tmp_path / 'branches.xls')
+    path = tmp_path / 'branches.csv'
+    path.write_text("name,lat\na,35.7\n", encoding='utf-8')
+    with pytest.raises(LocationFileError, match='lng'):
+        read_locations(path)
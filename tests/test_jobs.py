@@ -0,0 +1,70 @@
+import socket
+import time
+
+from benchmark import synthetic_instance
+from jobs import JobQueue, run_plan_job
+from neshan import TokenBucket
+
+
+def wait(job, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not job.done:
+        assert time.monotonic() < deadline, "کار در زمان مجاز تمام نشد"
+        time.sleep(0.05)
+    return job
+
+
+def closed_url():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/v1/distance-matrix"
+
+
+def test_failed_plan_is_not_served_again(server):
+    locations, names = synthetic_instance(6)
+    queue = JobQueue(max_workers=1)
+    plan = (locations, names, 900, "08:00", {})
+
+    broken = {'requests_per_second': 1000.0, 'distance_matrix_url': closed_url()}
+    failed = wait(queue.submit('instance', run_plan_job, 'api key', broken, *plan))
+    assert failed.status == 'failed' and failed.result is None
+    assert any(level == 'error' for level, _ in failed.messages)
+
+    working = {'requests_per_second': 1000.0, 'distance_matrix_url': server.distance_matrix_url,
+               'direction_url': server.direction_url}
+    job = wait(queue.submit('instance', run_plan_job, 'api key', working, *plan))
+    assert job is not failed
+    assert job.status == 'done' and job.result['results']['route_points'][0] == 0
+    assert queue.submit('instance', run_plan_job, 'api key', working, *plan) is job
+
+
+def test_concurrent_jobs_share_one_rate_limiter(server):
+    class CountingBucket(TokenBucket):
+        acquired = 0
+
+        def acquire(self):
+            CountingBucket.acquired += 1
+            super().acquire()
+
+    limiter = CountingBucket(1000.0)
+    options = {'rate_limiter': limiter, 'distance_matrix_url': server.distance_matrix_url,
+               'direction_url': server.direction_url}
+    queue = JobQueue(max_workers=2)
+    jobs = [queue.submit(f'instance-{seed}', run_plan_job, 'api key', options,
+                         *synthetic_instance(6, seed=seed), 900, "08:00", {})
+            for seed in (1, 2)]
+    assert all(wait(job).status == 'done' for job in jobs)
+    assert limiter.acquired == server.counts['distance-matrix'] + server.counts['direction'] > 0
+
+
+def test_failed_jobs_expire_after_failure_ttl():
+    def fail(job):
+        raise ValueError("خطا")
+
+    queue = JobQueue(max_workers=1, failure_ttl=0)
+    job = wait(queue.submit('a', fail))
+    assert job.error == "خطا" and queue.get('a') is job
+    time.sleep(0.01)
+    wait(queue.submit('b', lambda job: 1))
+    assert queue.get('a') is None and queue.get('b').result == 1
@@ -0,0 +1,51 @@
+import time
+
+import numpy as np
+
+from leg_cache import LegCache
+
+POINTS = [(35.7 + i * 0.01, 51.4 + i * 0.01) for i in range(12)]
+
+
+def test_get_legs_maps_cached_legs_back_to_indices(tmp_path):
+    cache = LegCache(str(tmp_path / 'legs.sqlite3'))
+    assert all(len(column) == 0 for column in cache.get_legs(POINTS, 'car'))
+
+    cache.put_many([(POINTS[i], POINTS[j], 100 * i + j, j) for i in range(12) for j in range(12) if i != j], 'car')
+    cache.put_many([(POINTS[0], (36.0, 52.0), 1, 1)], 'car')
+    cache.put_many([(POINTS[0], POINTS[1], 7, 7)], 'motorcycle')
+
+    locations = [POINTS[5], POINTS[2], POINTS[9]]
+    rows, cols, distances, durations = cache.get_legs(locations, 'car')
+    assert sorted(zip(rows, cols)) == [(i, j) for i in range(3) for j in range(3) if i != j]
+    index = [5, 2, 9]
+    np.testing.assert_array_equal(distances, [100 * index[i] + index[j] for i, j in zip(rows, cols)])
+    np.testing.assert_array_equal(durations, [index[j] for j in cols])
+
+
+def test_expired_legs_are_not_returned(tmp_path):
+    cache = LegCache(str(tmp_path / 'legs.sqlite3'), ttl=0.05)
+    cache.put(POINTS[0], POINTS[1], 'car', [[35.7, 51.4]], 500, 60, [])
+    cache.put_many([(POINTS[1], POINTS[0], 500, 60)], 'car')
+    assert cache.get(POINTS[0], POINTS[1], 'car') is not None
+    time.sleep(0.1)
+    assert cache.get(POINTS[0], POINTS[1], 'car') is None
+    assert len(cache.get_legs(POINTS[:2], 'car')[0]) == 0
+
+
+def test_max_entries_evicts_least_recently_used(tmp_path):
+    cache = LegCache(str(tmp_path / 'legs.sqlite3'), max_entries=10)
+    for j in range(1, 11):
+        cache.put(POINTS[0], POINTS[j], 'car', [], j, j, [])
+        time.sleep(0.002)
+    assert cache.get(POINTS[0], POINTS[1], 'car') is not None
+    time.sleep(0.01)
+
+    cache.put(POINTS[1], POINTS[0], 'car', [], 1, 1, [])
+    assert len(cache) == 10
+    assert cache.get(POINTS[0], POINTS[1], 'car') is not None
+    assert cache.get(POINTS[0], POINTS[2], 'car') is None
+
+    for i in range(2, 12):
+        cache.put(POINTS[i], POINTS[0], 'car', [], i, i, [])
+        assert len(cache) == 10
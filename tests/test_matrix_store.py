@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+from benchmark import synthetic_instance
+from leg_cache import MatrixStore
+from solver import _shared_matrix, solve_subsets
+
+
+def test_save_and_load_share_one_mapping(tmp_path, matrices):
+    store = MatrixStore(str(tmp_path))
+    locations, _ = synthetic_instance(5)
+    distance, time_matrix = matrices(6)
+    entry = store.save(locations, 'car', distance, time_matrix, np.ones((6, 6), dtype=bool))
+    assert isinstance(entry['time_matrix'], np.memmap) and entry['time_matrix'].dtype == np.int32
+    assert np.array_equal(entry['time_matrix'], time_matrix)
+    assert store.load(locations, 'car') is entry
+    assert store.load(locations, 'motorcycle') is None
+    assert store.load(locations[:-1], 'car') is None
+
+
+def test_pinned_matrix_survives_pruning(tmp_path, matrices):
+    store = MatrixStore(str(tmp_path), max_entries=1)
+    locations, _ = synthetic_instance(5)
+    entry = store.save(locations, 'car', *matrices(6), np.ones((6, 6), dtype=bool))
+    time_matrix = entry['time_matrix']
+    with _shared_matrix(time_matrix) as shared:
+        assert isinstance(shared, str)
+        other, _ = synthetic_instance(5, seed=1)
+        store.save(other, 'car', *matrices(6, seed=1), np.ones((6, 6), dtype=bool))
+        assert not os.path.exists(time_matrix.filename)
+        assert np.array_equal(np.load(shared, mmap_mode='r'), time_matrix)
+    assert not os.path.exists(shared)
+
+    # پس از هرس، فایل دیگر نیست و خود ماتریس به فرایندها فرستاده می‌شود
+    subsets = [[0, 1, 2, 3], [0, 4, 5]]
+    assert solve_subsets(time_matrix, subsets) == solve_subsets(np.array(time_matrix), subsets, max_workers=1)
+
+
+def test_replaced_matrix_is_not_shared_by_path(tmp_path, matrices):
+    store = MatrixStore(str(tmp_path))
+    locations, _ = synthetic_instance(5)
+    known = np.ones((6, 6), dtype=bool)
+    old = store.save(locations, 'car', *matrices(6), known)['time_matrix']
+    distance, time_matrix = matrices(6, seed=2)
+    store.save(locations, 'car', distance, time_matrix, known)
+    with _shared_matrix(old) as shared:
+        assert not isinstance(shared, str)
+        assert np.array_equal(shared, old) and not np.array_equal(shared, time_matrix)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.pin')]
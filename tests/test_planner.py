@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import synthetic_instance
+from geo import haversine_matrix, nearest_neighbors_mask
+from leg_cache import LegCache, MatrixCheckpoint, MatrixStore
+from mock_neshan import MockNeshanServer
+from neshan import NeshanAuthError
+from planner import RoutePlanner, build_route_table, plan_route
+from solver import build_schedule
+
+
+def make_planner(server, **options):
+    planner = RoutePlanner('test', requests_per_second=1000.0, direction_url=server.direction_url,
+                           distance_matrix_url=server.distance_matrix_url, **options)
+    planner.backoff_base = 0.01
+    return planner
+
+
+def expected_matrices(server, locations):
+    distance = haversine_matrix(locations) * server.detour
+    return distance.astype(int), (distance / server.speed).astype(int)
+
+
+@pytest.mark.parametrize('backend', ['matrix', 'direction'])
+def test_matrix_matches_mock_server(server, backend):
+    locations, _ = synthetic_instance(12)
+    distance, duration = make_planner(server, matrix_backend=backend).create_distance_time_matrices(locations)
+    expected_distance, expected_duration = expected_matrices(server, locations)
+    assert np.array_equal(distance, expected_distance)
+    assert np.array_equal(duration, expected_duration)
+
+
+def test_sparse_mode_fetches_only_nearest_neighbours(server):
+    locations, _ = synthetic_instance(30)
+    planner = make_planner(server, matrix_backend='direction')
+    distance, duration = planner.create_distance_time_matrices(locations, sparse_k=3)
+    straight = haversine_matrix(locations)
+    mask = nearest_neighbors_mask(straight, 3)
+    wanted = mask | mask.T
+    assert server.counts['direction'] == int(np.triu(wanted, 1).sum())
+
+    expected_distance, expected_duration = expected_matrices(server, locations)
+    assert np.array_equal(distance[wanted], expected_distance[wanted])
+    assert np.array_equal(duration[wanted], expected_duration[wanted])
+    # بقیه خانه‌ها با ضریب پیچ‌وخم مسیرهای واقعی از خط مستقیم برآورد می‌شوند
+    assert np.array_equal(planner.estimated, ~(wanted | np.eye(len(locations), dtype=bool)))
+    assert (distance[planner.estimated] >= straight[planner.estimated]).all()
+
+
+def test_stored_matrix_is_reused_without_requests(server, tmp_path):
+    store = MatrixStore(str(tmp_path))
+    locations, _ = synthetic_instance(15)
+    first = make_planner(server, matrix_store=store)
+    distance, duration = first.create_distance_time_matrices(locations)
+    requests = server.counts['distance-matrix']
+    assert requests > 0
+
+    second = make_planner(server, matrix_store=store)
+    reused_distance, reused_duration = second.create_distance_time_matrices(locations)
+    assert server.counts['distance-matrix'] == requests
+    assert second.metrics.total('nova_api_requests_total') == 0
+    assert np.array_equal(reused_distance, distance) and np.array_equal(reused_duration, duration)
+
+    # با یک نقطه جدید و ماتریس قبلی فقط سطر و ستون همان نقطه درخواست می‌شود
+    grown, _ = synthetic_instance(16)
+    third = make_planner(server, matrix_store=store)
+    grown_distance, _ = third.create_distance_time_matrices(locations + [grown[-1]],
+                                                            previous=store.load(locations, 'car'))
+    assert np.array_equal(grown_distance[:16, :16], distance)
+    assert third.metrics.total('nova_matrix_cells_total', source='api') == 2 * 16
+
+
+def test_cached_legs_fill_the_matrix_without_requests(server, tmp_path):
+    cache = LegCache(str(tmp_path / 'legs.sqlite3'))
+    locations, _ = synthetic_instance(15)
+    distance, duration = make_planner(server, cache=cache).create_distance_time_matrices(locations)
+    requests = server.counts['distance-matrix']
+
+    planner = make_planner(server, cache=cache)
+    cached_distance, cached_duration = planner.create_distance_time_matrices(locations[::-1])
+    assert server.counts['distance-matrix'] == requests
+    assert planner.metrics.total('nova_cache_lookups_total', result='hit') == len(locations) * (len(locations) - 1)
+    assert np.array_equal(cached_distance, distance[::-1, ::-1])
+    assert np.array_equal(cached_duration, duration[::-1, ::-1])
+
+
+def test_decomposed_plan_does_not_keep_a_sub_matrix(server):
+    locations, names = synthetic_instance(30)
+    planner = make_planner(server)
+    results = plan_route(planner, locations, names, 900, "08:00", decompose=True, cluster_size=10)
+    assert sorted(results['route_points'][:-1]) == list(range(len(locations)))
+    assert planner.last_matrix is None
+
+
+def test_interrupted_build_resumes_from_checkpoint(server, tmp_path):
+    checkpoint = MatrixCheckpoint(str(tmp_path))
+    locations, _ = synthetic_instance(30)
+    interrupted = make_planner(server, checkpoint=checkpoint, max_workers=1)
+    fetch_block, calls = interrupted.matrix_provider.fetch_block, []
+
+    def fail_after_five(origins, destinations):
+        calls.append(len(origins))
+        if len(calls) > 5:
+            raise NeshanAuthError("قطع ارتباط")
+        return fetch_block(origins, destinations)
+
+    interrupted.matrix_provider.fetch_block = fail_after_five
+    assert interrupted.create_distance_time_matrices(locations) == (None, None)
+    saved = checkpoint.load(locations, 'car')
+    size = len(locations)
+    assert size < saved['known'].sum() < size * size
+
+    # ساخت دوباره فقط بلوک‌های خانه‌های دریافت‌نشده را درخواست می‌کند
+    requests = server.counts['distance-matrix']
+    resumed = make_planner(server, checkpoint=checkpoint)
+    distance, duration = resumed.create_distance_time_matrices(locations)
+    assert server.counts['distance-matrix'] - requests == len(resumed.matrix_provider.blocks(~saved['known']))
+    assert resumed.metrics.total('nova_matrix_cells_total', source='checkpoint') == saved['known'].sum() - size
+    expected_distance, expected_duration = expected_matrices(server, locations)
+    assert np.array_equal(distance, expected_distance) and np.array_equal(duration, expected_duration)
+    assert checkpoint.load(locations, 'car') is None
+
+
+def test_transient_errors_are_retried():
+    locations, _ = synthetic_instance(20)
+    with MockNeshanServer(error_rate=0.3, seed=3) as server:
+        planner = make_planner(server)
+        distance, duration = planner.create_distance_time_matrices(locations)
+        assert server.counts['errors'] > 0
+    assert planner.metrics.total('nova_api_retries_total') > 0
+    expected_distance, expected_duration = expected_matrices(server, locations)
+    assert np.array_equal(distance, expected_distance) and np.array_equal(duration, expected_duration)
+
+
+def legacy_route_table(results):
+    """جدول مسیر با حلقه سطر به سطر نسخه اولیه برنامه (مرجع مقایسه)"""
+    route_data = []
+    current_time = datetime.strptime(results['start_time_str'], "%H:%M")
+    time_matrix, distance_matrix = results['time_matrix'], results['distance_matrix']
+    route_points = results['route_points']
+    for i, point_idx in enumerate(route_points):
+        next_travel_time = 0
+        if i < len(route_points) - 1:
+            next_travel_time = int(time_matrix[point_idx][route_points[i + 1]])
+        station_type = 'نقطه شروع' if i == 0 else ('نقطه پایان' if i == len(route_points) - 1 else 'نمایندگی')
+        departure_time = current_time
+        if 0 < i < len(route_points) - 1:
+            departure_time = current_time + timedelta(seconds=int(results['station_time']))
+        route_data.append({
+            'ردیف': i + 1,
+            'نام مکان': results['location_names'][point_idx],
+            'نوع': station_type,
+            'زمان رسیدن': current_time.strftime("%H:%M"),
+            'مدت توقف': f"{int(results['station_time'])//60} دقیقه" if 0 < i < len(route_points) - 1 else "-",
+            'زمان حرکت': departure_time.strftime("%H:%M") if i < len(route_points) - 1 else "-",
+            'زمان سفر تا ایستگاه بعدی': f"{next_travel_time//60:.0f} دقیقه" if next_travel_time > 0 else "-",
+            'مسافت تا ایستگاه بعدی': (f"{float(distance_matrix[point_idx][route_points[i+1]])/1000:.1f} کیلومتر"
+                                      if i < len(route_points) - 1 else "-")
+        })
+        if i < len(route_points) - 1:
+            if i > 0:
+                current_time += timedelta(seconds=int(results['station_time']))
+            current_time += timedelta(seconds=int(next_travel_time))
+    return pd.DataFrame(route_data), current_time
+
+
+@pytest.mark.parametrize('start_time_str', ["08:00", "21:30"])
+def test_vectorized_schedule_matches_legacy_loop(start_time_str):
+    locations, names = synthetic_instance(40)
+    distance = (haversine_matrix(locations) * 1.3).astype(np.int32)
+    duration = (distance // 8).astype(np.int32)
+    route = [0] + list(np.random.default_rng(0).permutation(np.arange(1, 41))) + [0]
+    schedule = build_schedule(route, duration, distance, 900)
+    results = {'route_points': route, 'location_names': names, 'start_time_str': start_time_str,
+               'station_time': 900, 'schedule': schedule, 'time_matrix': duration, 'distance_matrix': distance}
+
+    expected, end_time = legacy_route_table(results)
+    table = build_route_table(results)
+    assert table.astype(str).to_numpy().tolist() == expected.astype(str).to_numpy().tolist()
+    start = datetime.strptime(start_time_str, "%H:%M")
+    assert start + timedelta(seconds=schedule['total_time']) == end_time
+    assert schedule['total_distance'] == int(distance[route[:-1], route[1:]].sum())
+
+
+def test_prune_leg_store_keeps_current_locations(server):
+    locations, _ = synthetic_instance(4)
+    planner = make_planner(server)
+    for start, end in zip(locations, locations[1:]):
+        planner.remember_leg(start, end, [list(start), list(end)], 100, 10)
+    planner.prune_leg_store(locations[:3])
+    assert set(planner.leg_store) == {(locations[0], locations[1]), (locations[1], locations[2])}
+    # مسیر برگشت از مسیر رفت ذخیره‌شده (با دقت encoded polyline) ساخته می‌شود
+    assert np.allclose(planner.stored_leg(locations[2], locations[1])[0], [locations[2], locations[1]], atol=1e-5)
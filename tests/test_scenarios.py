@@ -0,0 +1,58 @@
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import scenarios
+from jobs import JobQueue, run_sweep_job
+from scenarios import ALL_STOPS, SweepFailed, group_subsets, run_sweep, stop_attributes
+from solver import build_schedule
+
+
+def test_group_subsets_follow_stop_order():
+    subsets = group_subsets(pd.Series(['a', 'b', None, 'a']))
+    assert subsets == {ALL_STOPS: [0, 1, 2, 3, 4], 'a': [0, 1, 4], 'b': [0, 2]}
+
+
+def test_stop_attributes_match_float32_coordinates():
+    branches = pd.DataFrame({'name': ['x', 'y'], 'lat': np.float32([35.7, 35.8]),
+                             'lng': np.float32([51.4, 51.5]), 'city': ['تهران', 'کرج']})
+    locations = [(35.6997, 51.338)] + [(float(lat), float(lng)) for lat, lng in
+                                       zip(branches['lat'][::-1], branches['lng'][::-1])]
+    assert stop_attributes(locations, branches)['city'].tolist() == ['کرج', 'تهران']
+
+
+def test_sweep_schedules_every_variant_on_one_route_per_subset(matrices):
+    distance_matrix, time_matrix = matrices(7)
+    subsets = {ALL_STOPS: list(range(7)), 'north': [0, 2, 4, 6]}
+    full_route = [0, 3, 1, 2, 6, 5, 4, 0]
+    per_stop = np.array([0, 60, 120, 180, 240, 300, 360])
+    services = {'10 دقیقه': 600, 'ستون': per_stop}
+    table = run_sweep(time_matrix, distance_matrix, subsets, services, ["08:00", "23:00"],
+                      routes={ALL_STOPS: full_route})
+    assert len(table) == 2 * 2 * 2
+
+    full = table[(table['نمایندگی‌ها'] == ALL_STOPS) & (table['زمان توقف'] == 'ستون')]
+    expected = build_schedule(full_route, time_matrix, distance_matrix, per_stop)
+    assert full['مدت کل (ساعت)'].tolist() == [round(expected['total_time'] / 3600, 2)] * 2
+    assert full['مسافت کل (کیلومتر)'].iloc[0] == round(expected['total_distance'] / 1000, 1)
+    assert full['زمان پایان'].iloc[1].endswith("(+1 روز)")
+    assert set(table.loc[table['نمایندگی‌ها'] == 'north', 'تعداد توقف']) == {3}
+
+
+def test_broken_pool_fails_the_sweep_with_a_clear_message(monkeypatch, matrices):
+    def broken(*args):
+        raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+
+    monkeypatch.setattr(scenarios, 'solve_subsets', broken)
+    distance_matrix, time_matrix = matrices(4)
+    with pytest.raises(SweepFailed):
+        run_sweep(time_matrix, distance_matrix, {'a': [0, 1, 2], 'b': [0, 3]}, {'0': 0}, ["08:00"])
+
+    queue = JobQueue(max_workers=1)
+    job = queue.submit('sweep', run_sweep_job, time_matrix, distance_matrix, {'a': [0, 1, 2]}, {'0': 0}, ["08:00"])
+    while not job.done:
+        time.sleep(0.01)
+    assert job.status == 'failed' and "دوباره اجرا کنید" in job.error
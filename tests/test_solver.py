@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+
+from solver import PORTFOLIO, build_transit_matrix, solve_portfolio, solve_route, warm_start_route
+
+
+def route_cost(matrix, route):
+    return int(matrix[route[:-1], route[1:]].sum())
+
+
+def test_stall_limit_stops_small_solves_early(matrices):
+    matrix, _ = matrices(10)
+    started = time.perf_counter()
+    stalled = solve_route(matrix, 0, time_limit=5)
+    assert time.perf_counter() - started < 2
+
+    started = time.perf_counter()
+    full = solve_route(matrix, 0, time_limit=1, stall_coefficient=None)
+    assert time.perf_counter() - started >= 0.9
+    assert sorted(stalled[:-1]) == list(range(10)) and stalled[0] == stalled[-1] == 0
+    assert route_cost(matrix, stalled) == route_cost(matrix, full)
+
+
+def test_warm_start_keeps_the_previous_order(matrices):
+    _, time_matrix = matrices(13, seed=3)
+    previous_locations = [(35.0 + k / 100, 51.0) for k in range(13)]
+    previous = solve_route(time_matrix[:12, :12], 900, time_limit=1, stall_coefficient=None)
+
+    # نقطه ۵ حذف و نقطه ۱۲ افزوده می‌شود
+    keep = [k for k in range(13) if k != 5]
+    locations = [previous_locations[k] for k in keep]
+    time_sub = time_matrix[np.ix_(keep, keep)]
+    transit = build_transit_matrix(time_sub, 900)
+    warm = warm_start_route(previous, previous_locations[:12], locations, transit)
+
+    added = len(locations) - 1
+    survivors = [keep.index(node) for node in previous[1:-1] if node != 5]
+    assert [node for node in warm[1:-1] if node != added] == survivors
+    tour = [0] + survivors + [0]
+    insertion = [transit[a, added] + transit[added, b] - transit[a, b] for a, b in zip(tour[:-1], tour[1:])]
+    assert warm.index(added) == int(np.argmin(insertion)) + 1
+    assert warm_start_route(previous, previous_locations[:12], locations[:6], transit[:6, :6]) is None
+
+    started = time.perf_counter()
+    resolved = solve_route(time_sub, 900, previous={'route_points': previous, 'locations': previous_locations[:12]},
+                           locations=locations)
+    assert time.perf_counter() - started < 1.5
+    cold = solve_route(time_sub, 900, time_limit=1, stall_coefficient=None)
+    assert route_cost(transit, resolved) == route_cost(transit, cold)
+
+
+def test_portfolio_returns_the_best_strategy_route(matrices):
+    _, time_matrix = matrices(12, seed=1)
+    transit = build_transit_matrix(time_matrix, 900)
+    strategies = PORTFOLIO[:2]
+    best = solve_portfolio(time_matrix, 900, time_limit=3, strategies=strategies, max_workers=2)
+
+    route = best['route_points']
+    assert route[0] == route[-1] == 0 and sorted(route[:-1]) == list(range(12))
+    assert best['cost'] == route_cost(transit, route) == min(best['costs'].values())
+    assert set(best['costs']) == {(first, meta, seed) for first, meta in strategies for seed in (0, 1)}
+    assert best['strategy'][:2] in strategies and 1 <= best['rounds'] == len(best['history']) <= 3
+    assert best['cost'] == route_cost(transit, solve_route(time_matrix, 900, time_limit=1, stall_coefficient=None))